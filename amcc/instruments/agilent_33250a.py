@@ -1,28 +1,21 @@
 
 
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
+from amcc.instruments.waveform_cache import get_waveform_cache, waveform_key
 import numpy as np
+import re
 
-class Agilent33250a(object):
+class Agilent33250a(GenericInstrument):
     """Python class for Agilent 33250a 80MHz Frequency Generator, written by Adam McCaughan"""
 
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+        super().__init__(visa_name)
+        # Skips re-uploading arbs the 33250a already holds, see set_arb_wf().  There
+        # is room for 4 user waveforms in non-volatile memory
+        self.waveform_cache = get_waveform_cache(self, max_entries = 4,
+                                                 list_function = self.arb_wf_sizes,
+                                                 delete_function = self.delete_arb_wf,
+                                                 in_use_function = self.active_arb_wfs)
 
     def identify(self):
         return self.query('*IDN?')
@@ -117,23 +110,53 @@ class Agilent33250a(object):
         t = np.array(t);  v = np.array(v)
 
         v = v-min(v);  v = 2*v/max(v);  v = v-1
-        # Change timeout to 60 sec to allow writing of waveform
-        temp = self.pyvisa.timeout; self.pyvisa.timeout = 60e3
         t_interp = np.linspace(t[0],t[-1],2**14) # Can be up to 2**14 long
         v_interp = np.interp(t_interp, t, v)
 
-        data_strings = ['%0.3f' % x for x in v_interp]
-        data_msg = ', '.join(data_strings)
-
-        self.write('DATA VOLATILE, ' + data_msg) # Form of "DATA VOLATILE, 1, .67, .33, 0, -.33", p200 user's guide
+        # Sent as a little-endian binary block of 12-bit DAC values (-2047 to +2047)
+        dac = np.round(np.clip(v_interp, -1, 1)*2047).astype('<i2')
         name = name[0:8].upper()
-        self.write('DATA:COPY %s, VOLATILE' % name)
+        key = waveform_key(dac)
+        if not self.waveform_cache.lookup(name, key):
+            self.waveform_cache.make_room(name, dac.nbytes)
+            self.write('FORM:BORD SWAP')
+            self._write_block('DATA:DAC VOLATILE, ', dac)
+            self.write('DATA:COPY %s, VOLATILE' % name)
+            self.waveform_cache.store(name, key, dac.nbytes)
         self.write('APPL:USER')  # Set output to ARB
         self.write('FUNC:USER %s' % name) # Select the waveform in the volatile memory
         self.write('APPL:USER')
-        self.timeout = temp
         # self.write('FUNC USER') # Output the selected waveform
 
+    def _write_block(self, command, data):
+        """ Writes `command` followed by the bytes of the numpy array `data` as an
+        IEEE 488.2 definite-length block """
+        num_bytes = data.nbytes
+        header = '%s#%i%i' % (command, len(str(num_bytes)), num_bytes)
+        with self.lock:
+            self.pyvisa.write_raw(b''.join([header.encode(), data.tobytes(), b'\n']))
+
+    def list_arb_wfs(self):
+        """ Returns the names of the arbitrary waveforms stored on the 33250a """
+        return re.findall(r'"([^"]+)"', self.query('DATA:CAT?'))
+
+    def arb_wf_sizes(self):
+        """ Returns a dict of the arbitrary waveform names and their sizes in
+        bytes (2 bytes per point) """
+        return {name : 2*int(self.query('DATA:ATTR:POIN? %s' % name)) for name in self.list_arb_wfs()}
+
+    def active_arb_wfs(self):
+        """ Returns the name of the arbitrary waveform selected with FUNC:USER
+        (which the 33250a will not delete) """
+        return [self.query('FUNC:USER?').strip().strip('"').upper()]
+
+    def delete_arb_wf(self, name = 'ARB_PY'):
+        name = name[0:8].upper()
+        self.waveform_cache.forget(name)
+        error = self.query('DATA:DEL %s;:SYST:ERR?' % name).strip()
+        if not error.startswith(('+0', '0')):
+            raise RuntimeError('Could not delete arb waveform %s: %s' % (name, error))
+
     def setup_heartbeat_wf(self):
         heartbeat_t = [0.0, 4.0/8, 5.0/8, 6.0/8,  7.0/8, 8.0/8]
         heartbeat_v = [0.0,   0.0,   1.0,   0.0,   -1.0,   0.0]
@@ -1,32 +1,22 @@
 
 
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
+from amcc.instruments.waveform_cache import get_waveform_cache, waveform_key
 import numpy as np
+import re
 
-class Agilent33522a(object):
+class Agilent33522a(GenericInstrument):
     """Python class for Agilent 33522a 30MHz 2-channel
     arbitrary waveform generator, written by Adam McCaughan"""
 
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+        super().__init__(visa_name)
+        # Skips re-uploading arbs the 33522a already holds, see set_arb_wf()
+        self.waveform_cache = get_waveform_cache(self, list_function = self.arb_wf_sizes)
 
     def reset(self):
         self.write('*RST')
+        self.waveform_cache.clear()
         
     def identify(self):
         return self.query('*IDN?')
@@ -75,21 +65,29 @@ class Agilent33522a(object):
         vpp = max(v) - min(v)
         voffset = (max(v) + min(v))/2
         v = v-min(v);  v = 2*v/max(v);  v = v-1
-        # Change timeout to 60 sec to allow writing of waveform
-        temp = self.pyvisa.timeout; self.pyvisa.timeout = 20e3
         total_time = t[-1] - t[0]
-        num_samples = total_time/dt
+        num_samples = int(round(total_time/dt))
 
         t_interp = np.linspace(t[0],t[-1], num_samples)
         v_interp = np.interp(t_interp, t, v)
 
-        data_strings = ['%0.3f' % x for x in v_interp]
-        data_msg = ', '.join(data_strings)
-
-        self.write('SOURCE%s:FUNC ARB' % channel)
-        self.write('SOURce%s:DATA:VOLatile:CLEar' % channel)
-        self.write('SOURce%s:DATA:ARB TEMPARB%s, %s' % (channel, channel, data_msg))
-        self.write('SOURce%s:FUNCtion:ARBitrary TEMPARB%s' % (channel, channel))
+        # Sent as a little-endian binary block of 16-bit DAC values (-32767 to +32767)
+        dac = np.round(np.clip(v_interp, -1, 1)*32767).astype('<i2')
+        # Change timeout to 20 sec to allow writing of long waveforms
+        name = 'TEMPARB%s' % channel
+        key = waveform_key(dac)
+        with self.lock:
+            temp = self.pyvisa.timeout; self.pyvisa.timeout = 20e3
+            try:
+                self.write('SOURCE%s:FUNC ARB' % channel)
+                if not self.waveform_cache.lookup(name, key):
+                    self.write('FORM:BORD SWAP')
+                    self.write('SOURce%s:DATA:VOLatile:CLEar' % channel)
+                    self._write_block('SOURce%s:DATA:ARB:DAC %s, ' % (channel, name), dac)
+                    self.waveform_cache.store(name, key, dac.nbytes)
+                self.write('SOURce%s:FUNCtion:ARBitrary %s' % (channel, name))
+            finally:
+                self.pyvisa.timeout = temp
 
         sample_rate = num_samples/total_time
         if (sample_rate > 250e6):
@@ -98,6 +96,30 @@ class Agilent33522a(object):
         self.set_vpp(vpp, channel = channel)
         self.set_voffset(voffset, channel = channel)
 
+    def _write_block(self, command, data):
+        """ Writes `command` followed by the bytes of the numpy array `data` as an
+        IEEE 488.2 definite-length block """
+        num_bytes = data.nbytes
+        header = '%s#%i%i' % (command, len(str(num_bytes)), num_bytes)
+        with self.lock:
+            self.pyvisa.write_raw(b''.join([header.encode(), data.tobytes(), b'\n']))
+
+    def list_arb_wfs(self, channels = [1, 2]):
+        """ Returns the names of the arbitrary waveforms in volatile memory """
+        names = []
+        for channel in channels:
+            names += re.findall(r'"([^"]+)"', self.query('SOURce%s:DATA:VOLatile:CATalog?' % channel))
+        return names
+
+    def arb_wf_sizes(self, channels = [1, 2]):
+        """ Returns a dict of the arbitrary waveform names in volatile memory and
+        their sizes in bytes (2 bytes per point) """
+        sizes = {}
+        for channel in channels:
+            for name in self.list_arb_wfs(channels = [channel]):
+                sizes[name] = 2*int(float(self.query('SOURce%s:DATA:ATTRibute:POINts? %s' % (channel, name))))
+        return sizes
+
     def sync_arbs(self):
         """ Makes sure the first point of each arb waveform lines up initially """
         self.write('SOURCE:FUNC:ARB:SYNC')
@@ -1,25 +1,11 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
+import numpy as np
 
-class Agilent34401A(object):
+class Agilent34401A(GenericInstrument):
     """Python class for a generic SCPI-style instrument interface,
     written by Adam McCaughan"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+        super().__init__(visa_name)
 
     def identify(self):
         return self.query('*IDN?')
@@ -37,6 +23,37 @@ class Agilent34401A(object):
     def read_voltage(self):
         return float(self.query('MEAS?'))
 
+    def configure(self, function = 'VOLT:DC', range = 'AUTO', resolution = None, nplc = None):
+        """ Configures the measurement once (unlike MEAS?, which reconfigures the
+        meter on every call).  function is e.g. VOLT:DC / VOLT:AC / CURR:DC / RES / FRES """
+        if resolution is None:
+            self.write('CONF:%s %s' % (function, range))
+        else:
+            self.write('CONF:%s %s,%s' % (function, range, resolution))
+        if nplc is not None:
+            self.write('%s:NPLC %s' % (function, nplc))
+
+
+    def setup_acquisition(self, num_samples = 100, num_triggers = 1, trigger_source = 'IMM'):
+        """ Sets up a buffered acquisition of num_samples readings per trigger.  The
+        34401A stores up to 512 readings and only has ASCII output """
+        self.write('TRIG:SOUR %s' % trigger_source)
+        self.write('TRIG:COUN %s' % num_triggers)
+        self.write('SAMP:COUN %d' % num_samples)
+
+
+    def acquire(self, timeout = 60):
+        """ Runs the acquisition set up with setup_acquisition() and fetches every
+        reading with a single FETC?.  Returns a numpy array """
+        with self.lock:
+            temp = self.pyvisa.timeout; self.pyvisa.timeout = timeout*1e3
+            try:
+                self.write('INIT')
+                readings = self.query('FETC?')
+            finally:
+                self.pyvisa.timeout = temp
+        return np.array(readings.strip().split(','), dtype = np.float64)
+
 # g = GenericInstrument('GPIB0::24')
 # g.identify()
 
@@ -1,25 +1,12 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
+import numpy as np
+import time
 
-class Agilent34411A(object):
+class Agilent34411A(GenericInstrument):
     """Python class for a generic SCPI-style instrument interface,
     written by Adam McCaughan"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+        super().__init__(visa_name)
 
     def identify(self):
         return self.query('*IDN?')
@@ -37,6 +24,88 @@ class Agilent34411A(object):
     def read_voltage(self):
         return float(self.query('MEAS?'))
 
+    def configure(self, function = 'VOLT:DC', range = 'AUTO', resolution = None, nplc = None):
+        """ Configures the measurement once (unlike MEAS?, which reconfigures the
+        meter on every call).  function is e.g. VOLT:DC / VOLT:AC / CURR:DC / RES / FRES """
+        if resolution is None:
+            self.write('CONF:%s %s' % (function, range))
+        else:
+            self.write('CONF:%s %s,%s' % (function, range, resolution))
+        if nplc is not None:
+            self.write('%s:NPLC %s' % (function, nplc))
+
+
+    def setup_acquisition(self, num_samples = 1000, num_triggers = 1, trigger_source = 'IMM',
+                          sample_interval = None):
+        """ Sets up a buffered acquisition of num_samples readings per trigger.
+        num_triggers can be 'INF' for continuous streaming.  If sample_interval (in
+        seconds) is given, samples are paced by the internal timer (SAMP:SOUR TIM),
+        otherwise they are taken back-to-back.  acquire() and stream_readings()
+        transfer the readings as little-endian REAL,64 """
+        self.write('TRIG:SOUR %s' % trigger_source)
+        self.write('TRIG:COUN %s' % num_triggers)
+        self.write('SAMP:COUN %d' % num_samples)
+        if sample_interval is not None:
+            self.write('SAMP:SOUR TIM')
+            self.write('SAMP:TIM %0.6e' % sample_interval)
+        else:
+            self.write('SAMP:SOUR IMM')
+
+
+    def _binary_format(self, binary = True):
+        # Binary only for the bulk transfers, the MEAS? methods expect ASCII
+        if binary:
+            self.write('FORM:DATA REAL,64')
+            self.write('FORM:BORD SWAP')
+        else:
+            self.write('FORM:DATA ASC')
+
+    def _query_readings(self, command):
+        with self.lock:
+            return self.pyvisa.query_binary_values(command, datatype = 'd', is_big_endian = False,
+                                                   container = np.array)
+
+
+    def acquire(self, timeout = 60):
+        """ Runs the acquisition set up with setup_acquisition() (INIT, then waits
+        with *OPC?) and fetches every reading in one binary transfer with R?,
+        which also clears the reading memory.  Returns a numpy array """
+        with self.lock:
+            temp = self.pyvisa.timeout; self.pyvisa.timeout = timeout*1e3
+            try:
+                self._binary_format(True)
+                self.write('INIT')
+                self.query('*OPC?')
+                return self._query_readings('R?')
+            finally:
+                self.pyvisa.timeout = temp
+                self._binary_format(False)
+
+
+    def stream_readings(self, num_readings = None, max_chunk = 50000, poll_interval = 0.05):
+        """ Generator for acquisitions longer than the reading memory (e.g. after
+        setup_acquisition(num_triggers = 'INF')).  Starts the acquisition and
+        yields numpy arrays of new readings as they arrive, removing them from the
+        meter's memory with DATA:REM? so it never fills.  Stops after num_readings
+        readings (None streams until the generator is closed), then aborts """
+        self._binary_format(True)
+        self.write('INIT')
+        num_yielded = 0
+        try:
+            while (num_readings is None) or (num_yielded < num_readings):
+                num_available = int(self.query('DATA:POIN?'))
+                if num_readings is not None:
+                    num_available = min(num_available, num_readings - num_yielded)
+                if num_available == 0:
+                    time.sleep(poll_interval)
+                    continue
+                readings = self._query_readings('DATA:REM? %d' % min(num_available, max_chunk))
+                num_yielded += len(readings)
+                yield readings
+        finally:
+            self.write('ABOR')
+            self._binary_format(False)
+
 # g = GenericInstrument('GPIB0::24')
 # g.identify()
 
@@ -1,37 +1,25 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 import time
 
 
-class Agilent53131a(object):
+class Agilent53131a(GenericInstrument):
     """Python class for Agilent 53131a counter, written by Adam McCaughan
     Use like c = Agilent53131a('GPIB0::3')"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+        super().__init__(visa_name)
+        self._gate_time = None
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
-        
     def identify(self):
         return self.query('*IDN?')
 
     def reset(self):
         self.write('*RST')
+        self._gate_time = None
 
     def basic_setup(self):
         self.write('*RST')
+        self._gate_time = 0.1
         self.write('*CLS')
 
         self.write(':EVEN:LEV:AUTO OFF') # Turn off auto trigger level
@@ -88,11 +76,17 @@ class Agilent53131a(object):
             self.write(':EVEN:LEV:AUTO OFF') # Turn off auto trigger level
             self.write(':EVEN%s:LEV %0.3fV' % (channel, trigger_voltage)) # Set trigger level
 
+    def set_trigger_level(self, trigger_voltage = 0.500, channel = 1):
+        """ Only changes the trigger level (auto level must already be off, e.g.
+        from set_trigger()), so scans send a single command per point """
+        self.write(':EVEN%s:LEV %0.3fV' % (channel, trigger_voltage))
+
     def setup_timed_count(self, channel = 1):
         self.write(':INP:FILT OFF') # Turn off 100kHz lowpass filter
         self.write(':FUNC "TOT %s"' % channel) # Totalize on channel 1
         self.write(':TOT:ARM:STAR:SOUR IMM') # Set start source to immediate (run on command)
         self.write(':TOT:ARM:STOP:SOUR TIM') # Set stop source to time (wait certain time)
+        self._gate_time = None
 
 
     def setup_ratio(self):
@@ -100,38 +94,141 @@ class Agilent53131a(object):
         self.write(':FREQ:ARM:STAR:SOUR IMM') # Set start source to immediate (run on command)
         self.write(':FREQ:ARM:STOP:SOUR TIM') # Set stop source to time (wait certain time)
 
+    def set_gate_time(self, counting_time = 0.1):
+        """ Sets the totalize gate (the counter's own arm/stop timer), skipping the
+        write if it is already set """
+        if counting_time != self._gate_time:
+            self.write(':TOT:ARM:STOP:TIM %0.3f' % counting_time) # Set stop time to # of seconds
+            self._gate_time = counting_time
+
+    def read_counts(self, counting_time = 0.1):
+        """ Counts for one gate of counting_time seconds (after setup_timed_count)
+        and returns the number of counts """
+        with self.lock:
+            self.set_gate_time(counting_time)
+            temp = self.pyvisa.timeout
+            self.pyvisa.timeout = max(temp, (counting_time + 5)*1e3)
+            try:
+                counts = self.query(':READ?')
+            finally:
+                self.pyvisa.timeout = temp
+        return int(float(counts))
+
     def timed_count(self, counting_time = 0.1):
-        self.write(':TOT:ARM:STOP:TIM %0.3f' % counting_time) # Set stop time to # of seconds
-        dcr = self.query(':READ?')
-        dcr = float(dcr)/counting_time
-        # time.sleep(counting_time + 0.1)
-        return dcr
+        """ Returns the count rate (counts/s) over one gate of counting_time """
+        return self.read_counts(counting_time)/counting_time
 
     def timed_frequency_ratio(self, counting_time = 0.1):
         self.write(':FREQ:ARM:STOP:TIM %0.3f' % counting_time) # Set stop time to # of seconds
         ratio = float(self.query(':READ?'))
         return ratio
 
-    def counts_vs_time(self, trigger_voltage= -0.075, counting_time=0.1, total_time=2):
-        self.set_trigger(trigger_voltage)
-        num_tests = int(total_time/counting_time)
-        dcr = []
-        t = []
+    def stream_counts(self, counting_time = 0.1, total_time = None, num_gates = None):
+        """ Generator that counts back-to-back gates of counting_time seconds
+        (after setup_timed_count) and yields (t, counts, rate) for each one, where
+        t is the time since the start of the stream at which the gate was
+        requested.  Runs for total_time seconds / num_gates gates, or until the
+        generator is closed if neither is given """
         start_time = time.time()
-        for n in range(num_tests):
-            dcr.append(self.get_dcr(counting_time))
-            t.append(time.time() - start_time)
+        n = 0
+        while (num_gates is None) or (n < num_gates):
+            t = time.time() - start_time
+            if (total_time is not None) and (t + counting_time > total_time):
+                break
+            counts = self.read_counts(counting_time)
+            n += 1
+            yield t, counts, counts/counting_time
 
-        return  t, dcr
+    def counts_vs_time(self, trigger_voltage= -0.075, counting_time=0.1, total_time=2):
+        """ Returns arrays of time (s) and count rate (counts/s) """
+        self.set_trigger(trigger_voltage)
+        num_tests = int(round(total_time/counting_time))
+        data = np.array(list(self.stream_counts(counting_time, num_gates = num_tests)))
+        if len(data) == 0:
+            return np.array([]), np.array([])
+        return data[:,0], data[:,2]
     
 
     def scan_trigger_voltage(self, voltages=np.linspace(0,0.1,40), counting_time=0.1):
-        counts_list = []
-        for v in voltages:
-            self.set_trigger(v)
-            time.sleep(0.1)
-            counts = self.timed_count(counting_time)
-            counts_list.append(counts)
-            print(('Trigger voltage = %0.3f  /  Count rate %0.1f' % (v, counts)))
-        return voltages, np.array(counts_list)/float(counting_time)
-
+        """ Returns the voltages and the count rate (counts/s) at each one """
+        voltages = np.asarray(voltages, dtype = np.float64)
+        rates = np.empty(len(voltages))
+        for n, v in enumerate(voltages):
+            if n == 0: self.set_trigger(v)
+            else:      self.set_trigger_level(v)
+            rates[n] = self.read_counts(counting_time)/counting_time
+        return voltages, rates
+
+
+    def _adaptive_rate(self, relative_error, min_counting_time, max_counting_time,
+                       zero_rate = None):
+        """ Counts for a short probe gate, then for just long enough that the total
+        number of counts gives the target Poisson relative error 1/sqrt(N) (up to
+        max_counting_time).  If there are no counts, keeps counting in doubling
+        gates until one arrives, or until the ~95% upper bound on the rate
+        (3/counting_time) drops below zero_rate.  Returns (rate, uncertainty)
+        in counts/s """
+        counts = self.read_counts(min_counting_time)
+        counting_time = min_counting_time
+        counts_needed = 1/relative_error**2
+        while counts == 0:
+            if (zero_rate is not None) and (3/counting_time < zero_rate):
+                break # Zero as far as the scan cares
+            extra_time = min(counting_time, max_counting_time - counting_time)
+            extra_time = np.ceil(extra_time*1e3)/1e3 # Gate time has 1 ms resolution
+            if extra_time < 1e-3:
+                break
+            counts += self.read_counts(extra_time)
+            counting_time += extra_time
+        if 0 < counts < counts_needed:
+            rate = counts/counting_time
+            extra_time = min((counts_needed - counts)/rate, max_counting_time - counting_time)
+            extra_time = np.ceil(extra_time*1e3)/1e3 # Gate time has 1 ms resolution
+            if extra_time >= 1e-3:
+                counts += self.read_counts(extra_time)
+                counting_time += extra_time
+        return counts/counting_time, np.sqrt(max(counts, 1))/counting_time
+
+    def scan_trigger_voltage_adaptive(self, v_min = 0, v_max = 0.1, num_initial = 11,
+                                      max_points = 60, min_spacing = 1e-3, relative_error = 0.05,
+                                      min_counting_time = 0.01, max_counting_time = 1,
+                                      refine_fraction = 0.05):
+        """ Faster alternative to scan_trigger_voltage().  Instead of spending the
+        same counting time everywhere, each point counts only until the Poisson
+        relative error reaches relative_error (points with no counts keep
+        counting only until their rate is known to be below refine_fraction of
+        the highest rate seen so far).  After a coarse scan of
+        num_initial points, the interval where the count rate changes the most is
+        bisected, over and over, until the remaining rate changes are all smaller
+        than refine_fraction of the maximum rate (or are within the noise), the
+        intervals are narrower than min_spacing, or max_points points have been
+        taken.  Returns the (sorted) voltages and count rates in counts/s """
+        voltages = list(np.linspace(v_min, v_max, num_initial))
+        rates = []
+        errors = []
+        for n, v in enumerate(voltages):
+            if n == 0: self.set_trigger(v)
+            else:      self.set_trigger_level(v)
+            zero_rate = refine_fraction*max(rates) if rates else None
+            rate, error = self._adaptive_rate(relative_error, min_counting_time, max_counting_time,
+                                              zero_rate = zero_rate or None)
+            rates.append(rate)
+            errors.append(error)
+
+        while len(voltages) < max_points:
+            v, r, e = np.array(voltages), np.array(rates), np.array(errors)
+            change = np.abs(np.diff(r))
+            refine = ((np.diff(v) >= 2*min_spacing) & (change > refine_fraction*r.max())
+                      & (change > 2*np.hypot(e[1:], e[:-1])))
+            if not np.any(refine):
+                break
+            n = np.argmax(np.where(refine, change, -1))
+            v_new = (v[n] + v[n+1])/2
+            self.set_trigger_level(v_new)
+            rate, error = self._adaptive_rate(relative_error, min_counting_time, max_counting_time,
+                                              zero_rate = refine_fraction*r.max() or None)
+            voltages.insert(n+1, v_new)
+            rates.insert(n+1, rate)
+            errors.insert(n+1, error)
+
+        return np.array(voltages), np.array(rates)
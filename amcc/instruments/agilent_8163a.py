@@ -1,26 +1,11 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 from time import sleep
 import numpy as np
 
-class Agilent8163A(object):
+class Agilent8163A(GenericInstrument):
     """Python class for Agilent 8163A power meter, written by Sam Adler"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+        super().__init__(visa_name)
 
 
     def reset(self):
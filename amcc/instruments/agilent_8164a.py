@@ -5,38 +5,20 @@ Created on Tue Jul 16 08:00:39 2019
 @author: smb2
 """
 
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import time
 import numpy as np
 from pyvisa.resources import MessageBasedResource
 
-class Agilent8164A(object):
+class Agilent8164A(GenericInstrument):
     """Python class for Agilent E5061B Network Analyzer, written by Sonia, modified from Adams code"""
 
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+        super().__init__(visa_name)
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def read_raw(self):
-        return self.pyvisa.read_raw()
-    
     def read_hex(self):
         return self.query_ascii_values(converter='x')
     
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
-
     def reset(self):
         self.write('*RST')
         self.timeout = 1
@@ -1,13 +1,11 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 
-class Agilent89410a:
+class Agilent89410a(GenericInstrument):
     def __init__(self, visa_name, trace=1):
         if not 1<=int(trace)<=4:
             raise Exception('Trace must be integer between 1 and 4')
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
+        super().__init__(visa_name)
         self.trace = str(int(trace))
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
 
     def identify(self):
         # expected output: HEWLETT-PACKARD,89410A,3416A01211,A.09.01
@@ -1,40 +1,121 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 from time import sleep
+import time
 import numpy as np
 
-class AgilentE5061B(object):
+class AgilentE5061B(GenericInstrument):
     """Python class for Agilent E5061B Network Analyzer, written by Adam McCaughan"""
 
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+        super().__init__(visa_name)
+        self._clear_settings()
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+    def _clear_settings(self):
+        self._binary_format = False
+        self._num_traces = {} # Maps channel -> number of traces, read once
 
     def reset(self):
         self.write('*RST')
-        self.timeout = 1
+        self._clear_settings()
         
     def identify(self):
         return self.query('*IDN?')
 
-    def get_channel_data(self, channel = 1):
-        self.write(':FORM:DATA ASC')
-        m = self.ask_for_values(':CALC1:DATA:FDAT?'); m = m[::2]
-        f = self.ask_for_values(':SENS1:FREQ:DATA?')
-        return f,m
+    def num_traces(self, channel = 1):
+        if channel not in self._num_traces:
+            self._num_traces[channel] = int(self.query(':CALC%i:PAR:COUN?' % channel))
+        return self._num_traces[channel]
+
+    def set_num_traces(self, num_traces = 1, channel = 1):
+        self.write(':CALC%i:PAR:COUN %i' % (channel, num_traces))
+        self._num_traces[channel] = num_traces
+
+    def _read_block(self):
+        # Reads an IEEE definite-length block of little-endian 64-bit floats
+        # and the ';' or '\n' that follows it
+        hash_symbol = self.pyvisa.read_bytes(count = 1)
+        num_digits = int(self.pyvisa.read_bytes(count = 1))
+        len_data = int(self.pyvisa.read_bytes(count = num_digits))
+        data = self.pyvisa.read_bytes(count = len_data)
+        term_char = self.pyvisa.read_bytes(count = 1)
+        return np.frombuffer(data, dtype = '<f8')
+
+    def _query_blocks(self, commands):
+        """ Sends all the queries in one message and reads back their binary
+        responses, in order """
+        with self.lock:
+            if not self._binary_format:
+                self.write(':FORM:DATA REAL') # 64-bit floats
+                self.write(':FORM:BORD SWAP') # Little-endian
+                self._binary_format = True
+            self.write(';'.join(commands))
+            return [self._read_block() for c in commands]
+
+    def _data_commands(self, channels, traces, data_type):
+        # Returns the queries for the frequencies and traces of each channel
+        commands = []
+        for ch in channels:
+            commands.append(':SENS%i:FREQ:DATA?' % ch)
+            for tr in traces[ch]:
+                commands.append(':CALC%i:TRAC%i:DATA:%s?' % (ch, tr, data_type))
+        return commands
+
+    def get_data(self, channels = [1], traces = None, data_type = 'FDAT'):
+        """ Fetches the frequencies and complex data of several channels and
+        traces in a single binary transfer.  traces maps each channel to a
+        list of trace numbers (default all traces of the channel).  data_type
+        is 'FDAT' (formatted data, primary + secondary value) or 'SDAT'
+        (corrected data, real + imaginary).  Returns a dict mapping channel ->
+        (f, data), with data a complex array of shape (num_traces, num_points) """
+        channels = list(np.atleast_1d(channels))
+        if traces is None:
+            traces = {ch : range(1, self.num_traces(ch) + 1) for ch in channels}
+        blocks = self._query_blocks(self._data_commands(channels, traces, data_type))
+        results = {}
+        for ch in channels:
+            f = blocks.pop(0)
+            data = [blocks.pop(0).view(np.complex128) for tr in traces[ch]]
+            results[ch] = (f, np.array(data))
+        return results
+
+    def get_channel_data(self, channel = 1, traces = None, data_type = 'FDAT'):
+        """ Returns (f, m) for the active trace of the channel, with m the
+        complex data (primary value in the real part).  If traces is a list of
+        trace numbers, m is a 2D array with one row per trace """
+        if traces is None:
+            f, m = self._query_blocks([':SENS%i:FREQ:DATA?' % channel,
+                                       ':CALC%i:DATA:%s?' % (channel, data_type)])
+            return f, m.view(np.complex128)
+        return self.get_data(channels = [channel], traces = {channel : traces},
+                             data_type = data_type)[channel]
+
+    def stream_sweeps(self, channels = [1], traces = None, data_type = 'FDAT',
+                      num_sweeps = None, timeout = 60):
+        """ Generator for time-resolved measurements (e.g. resonator tracking).
+        Triggers sweeps back to back and yields (t, data) after each one, with
+        t the time.time() the sweep completed and data as returned by
+        get_data().  Runs forever if num_sweeps is None; the trigger source is
+        set back to internal when the generator is closed """
+        channels = list(np.atleast_1d(channels))
+        if traces is None:
+            traces = {ch : range(1, self.num_traces(ch) + 1) for ch in channels}
+        for ch in channels:
+            self.write(':INIT%i:CONT ON' % ch)
+        self.write(':TRIG:SOUR BUS')
+        try:
+            n = 0
+            while (num_sweeps is None) or (n < num_sweeps):
+                with self.lock:
+                    temp = self.pyvisa.timeout; self.pyvisa.timeout = timeout*1e3
+                    try:
+                        self.query(':TRIG:SING;*OPC?') # Waits until the sweep is done
+                    finally:
+                        self.pyvisa.timeout = temp
+                t = time.time()
+                yield t, self.get_data(channels = channels, traces = traces, data_type = data_type)
+                n += 1
+        finally:
+            self.write(':TRIG:SOUR INT')
 
 
 # na = AgilentE5061B('GPIB0::17')
@@ -1,32 +1,29 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 
-class AgilentFieldFox(object):
+class AgilentFieldFox(GenericInstrument):
     """Python class for a generic SCPI-style instrument interface,
     written by Adam McCaughan"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 30000 # Set response timeout (in milliseconds)
+        super().__init__(visa_name)
+        self.set_session_attributes(timeout = 30000) # Set response timeout (in milliseconds)
         # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+        self._clear_settings()
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+    def _clear_settings(self):
+        # Sweep settings are cached once set (or first read back) so that
+        # measure() does not have to ask for them every call
+        self.num_points = None
+        self.f_start = None
+        self.f_stop = None
+        self._binary_format = False
 
     def identify(self):
         return self.query('*IDN?')
 
     def reset(self):
         self.write('*RST')
+        self._clear_settings()
 
 
     # Sets measurement mode (Input 'S11' or 'S21')
@@ -46,9 +43,12 @@ class AgilentFieldFox(object):
             self.write('INIT:CONT 1')
             # Set mode to S11
             self.write('CALC:PAR:DEF S21')
+        self._binary_format = False # Mode changes may reset the data format
         
     def set_num_points(self, num_points = 201):
             self.write('SWE:POIN %i' % num_points)
+            self.num_points = None # Read back what the instrument applied
+            self.get_sweep_settings()
 
     # Sets frequency range
     def set_freq_range(self, f_start = 10e6, f_stop = 3e9, f_center = None, f_span = None):
@@ -61,6 +61,8 @@ class AgilentFieldFox(object):
         elif (f_center is not None) and (f_span is not None):
             self.write('FREQ:CENT %0.6e' % f_center)
             self.write('FREQ:SPAN %0.6e' % f_span)
+        self.f_start, self.f_stop = None, None # Read back what the instrument applied
+        self.get_sweep_settings()
 
         
     # Changes the power (0 to -31 dBm in 1 dBm steps)
@@ -72,41 +74,63 @@ class AgilentFieldFox(object):
         # Select measurement format
         self.write('CALC:FORM %s' % measure_format)
 
+    def get_sweep_settings(self):
+        """ Returns (num_points, f_start, f_stop), only asking the instrument for
+        the ones that have not been read already (set_num_points() and
+        set_freq_range() read them back) """
+        if self.num_points is None:
+            self.num_points = int(self.query('SENS:SWEEP:POINTS?'))
+        if (self.f_start is None) or (self.f_stop is None):
+            self.f_start = float(self.query('SENS:FREQ:STAR?'))
+            self.f_stop = float(self.query('SENS:FREQ:STOP?'))
+        return self.num_points, self.f_start, self.f_stop
+
+    def _read_block(self):
+        # Reads an IEEE definite-length block of little-endian 64-bit floats
+        with self.lock:
+            hash_symbol = self.pyvisa.read_bytes(count = 1)
+            num_digits = int(self.pyvisa.read_bytes(count = 1))
+            len_data = int(self.pyvisa.read_bytes(count = num_digits))
+            data = self.pyvisa.read_bytes(count = len_data)
+            term_char = self.pyvisa.read_bytes(count = 1)
+        return np.frombuffer(data, dtype = '<f8')
+
     # Pull whatever S21 or S11 data is on the screen - in terms of dB or absolute magnitude
     def measure(self, trace = 1):
-        num_points = int(self.query('SENS:SWEEP:POINTS?'))
-        freq_start = float(self.query('SENS:FREQ:STAR?'))
-        freq_stop = float(self.query('SENS:FREQ:STOP?'))
+        """ Runs a single sweep and returns (freqs, mags), where mags is the
+        formatted data of `trace`.  In formats with two values per point (polar,
+        Smith) mags is complex, real + imaginary.  If trace is a list of trace
+        numbers, all of them are read from the same sweep and mags is a 2D
+        array with one row per trace.  Data is transferred as binary REAL,64 """
+        num_points, freq_start, freq_stop = self.get_sweep_settings()
+        if not self._binary_format:
+            self.write('FORM:DATA REAL,64')
+            self.write('FORM:BORD SWAP') # Little-endian
+            self._binary_format = True
 
         # Setup Network Analyser
         self.write('INIT:CONT 0')    # Turn off continuous sweeping
         self.query('INIT:IMM;*OPC?') # Initiate 1 sweep and wait until operation complete
-        # Select trace to measure
-        self.write('CALC:PAR%i:SEL' % trace)
-            
-        # Read data and parse into a list of floats
-        magnitude_data = self.query('CALC:DATA:FDATa?')
-        magnitude_data = magnitude_data.split(",")
-        mags = [None] * num_points
-        for i in range(0, num_points):
-            mags[i] = float(magnitude_data[i])
-                
+
+        traces = np.atleast_1d(trace)
+        mags = []
+        for t in traces:
+            with self.lock:
+                self.write('CALC:PAR%i:SEL' % t) # Select trace to measure
+                self.write('CALC:DATA:FDATa?')
+                data = self._read_block()
+            if len(data) == 2*num_points:
+                data = data.view(np.complex128) # Interleaved real, imaginary
+            elif len(data) != num_points:
+                raise ValueError('Trace %i has %i values, expected %i points' % (t, len(data), num_points))
+            mags.append(data)
+
         # Creating a vector of frequencies to correspond to magnitude data
-        freq_range = freq_stop - freq_start
-        freq_increment = freq_range / (num_points - 1)
-        
-        # Initialising variable "freqs" with num_points number of elements
-        freqs = [None] * num_points
-        for i in range(0, num_points):
-            freqs[i] = freq_start + freq_increment * i
+        freqs = np.linspace(freq_start, freq_stop, num_points)
 
         self.write('INIT:CONT 1') # Turn back on continuous sweeping
 
         # Return values
-        return np.array(freqs), np.array(mags)
-
-
-
-
-
-
+        if np.ndim(trace) == 0:
+            return freqs, mags[0]
+        return freqs, np.array(mags)
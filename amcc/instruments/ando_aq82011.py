@@ -1,13 +1,13 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 import math
 
-class AndoAQ82011(object):
+class AndoAQ82011(GenericInstrument):
     """Python class for Ando base laser, written by Sam Adler
     Use like ando = AndoAQ82011('GPIB0::5::INSTR')"""
     def __init__(self, address):
-        self.rm = visa.ResourceManager()
-        self.instrument = self.rm.open_resource(address)
+        super().__init__(address)
+        self.instrument = self.pyvisa
 
     def std_init(self, channel):
         self.instrument.write(f"C{channel}")
@@ -1,14 +1,14 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 import time
 import threading
 
-class AndoAQ82012(object):
+class AndoAQ82012(GenericInstrument):
     """Python class for base optical power meter, written by Sam Adler
     Use like ando = AndoAQ82012('GPIB0::5::INSTR')"""
     def __init__(self, address):
-        self.rm = visa.ResourceManager()
-        self.instrument = self.rm.open_resource(address)
+        super().__init__(address)
+        self.instrument = self.pyvisa
 
         rng_list = np.arange(30, -70, -10)
         self.rng_dict = {}
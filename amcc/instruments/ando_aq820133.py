@@ -1,13 +1,13 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 import time
 
-class AndoAQ820133(object):
+class AndoAQ820133(GenericInstrument):
     """Python class for ando attenuator, written by Sam Adler
     Use like ando = AndoAQ820133('GPIB0::5::INSTR')"""
     def __init__(self, address):
-        self.rm = visa.ResourceManager()
-        self.instrument = self.rm.open_resource(address)
+        super().__init__(address)
+        self.instrument = self.pyvisa
 
     def get_att(self, channel):
         loop = 0
@@ -1,12 +1,12 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import time
 
-class AndoAQ8201418(object):
+class AndoAQ8201418(GenericInstrument):
     """Python class for Ando base optical switch, written by Sam Adler
     Use like ando = AndoAQ8201418('GPIB0::5::INSTR')"""
     def __init__(self, address):
-        self.rm = visa.ResourceManager()
-        self.instrument = self.rm.open_resource(address)
+        super().__init__(address)
+        self.instrument = self.pyvisa
 
     def get_route(self, channel):
         loop = 0
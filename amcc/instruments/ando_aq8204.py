@@ -1,15 +1,15 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 import time
 import math
 import threading
 
-class AndoAQ8204(object):
+class AndoAQ8204(GenericInstrument):
     """Python class for Ando rack aq8204, written by Sam Adler
     Use like ando = aq8204('GPIB0::5::INSTR')"""
     def __init__(self, address):
-        self.rm = visa.ResourceManager()
-        self.instrument = self.rm.open_resource(address)
+        super().__init__(address)
+        self.instrument = self.pyvisa
 
         rng_list = np.arange(30, -70, -10)
         self.rng_dict = {}
@@ -1,22 +1,10 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 
-class AnritsuMG9638A(object):
+class AnritsuMG9638A(GenericInstrument):
     """Python class for Antritsu M9638 tunable laser source, written by Adam McCaughan.  Adapted from 
     Mihir's MATLAB code"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
+        super().__init__(visa_name)
 
 
     def reset(self):
@@ -25,9 +13,6 @@ class AnritsuMG9638A(object):
     def identify(self):
         return self.query('*IDN?')
 
-    def close(self):
-        self.pyvisa.close()
-
 
     def setup_basic(self):
         self.write('MCW') # Set laser to CW mode
@@ -0,0 +1,180 @@
+import numpy as np
+import threading
+import time
+import os
+
+
+class RingBuffer(object):
+    """ Fixed-size (time, value) history with a single writer and any number of
+    readers.  The writer fills the slot and only then advances `count`, so
+    readers never need a lock: they snapshot `count` and re-check it afterwards
+    to detect (and retry) the rare case where the writer lapped them.  The
+    writer may be halfway through the slot at index `count`, so readers never
+    return that slot and history() holds at most capacity - 1 samples """
+
+    def __init__(self, capacity = 100000):
+        if capacity < 2:
+            raise ValueError('capacity must be at least 2')
+        self.capacity = int(capacity)
+        self.times = np.full(self.capacity, np.nan)
+        self.values = np.full(self.capacity, np.nan)
+        self.count = 0
+
+    def append(self, t, value):
+        i = self.count % self.capacity
+        self.times[i] = t
+        self.values[i] = value
+        self.count += 1
+
+    def latest(self):
+        """ Returns the most recent (time, value), or (nan, nan) if empty """
+        while True:
+            n = self.count
+            if n == 0:
+                return np.nan, np.nan
+            i = (n - 1) % self.capacity
+            t, v = self.times[i], self.values[i]
+            if self.count - n < self.capacity - 1: # Slot i was not being rewritten
+                return t, v
+
+    def history(self):
+        """ Returns copies of the buffered (times, values), oldest first """
+        while True:
+            n = self.count
+            num_valid = min(n, self.capacity - 1)
+            start = (n - num_valid) % self.capacity
+            times = np.roll(self.times, -start)[:num_valid]
+            values = np.roll(self.values, -start)[:num_valid]
+            if self.count - n < self.capacity - num_valid: # Nothing we copied was being overwritten
+                return times, values
+
+    def value_at(self, t, interpolate = True):
+        """ Returns the value at time t, linearly interpolated between the
+        neighbouring samples or (interpolate = False) the last sample taken at or
+        before t.  Returns nan if t is outside of the buffered history """
+        times, values = self.history()
+        if len(times) == 0 or t < times[0] or t > times[-1]:
+            return np.nan
+        if interpolate:
+            return float(np.interp(t, times, values))
+        return float(values[np.searchsorted(times, t, side = 'right') - 1])
+
+
+class TelemetryLogger(object):
+    """ Background poller for slow housekeeping channels such as fridge
+    temperatures, so that measurement code can tag its data without issuing
+    any bus traffic of its own.  Each channel is a zero-argument read function
+    polled at its own period, e.g.
+
+        telemetry = TelemetryLogger(directory = 'telemetry')
+        telemetry.add_channel('T_mxc', lambda: sim921.read_resistance(), period = 2)
+        telemetry.add_channel('T_4K', lambda: sim922.read_temp(1), period = 10)
+        telemetry.start()
+        ...
+        t, R = telemetry.latest('T_mxc')
+        T = telemetry.value_at('T_4K', t_start_of_sweep)
+
+    Readings go into a lock-free RingBuffer per channel and, if `directory` is
+    given, are appended to two columnar files per channel (<name>.time.f8 and
+    <name>.value.f8, raw little-endian float64) which load_telemetry() reads back.
+    Reads that raise an exception are counted in `errors` and skipped """
+
+    def __init__(self, directory = None, capacity = 100000):
+        self.directory = directory
+        self.capacity = capacity
+        self.channels = {}
+        self.buffers = {}
+        self.errors = {}
+        self._files = {}
+        self._stop = threading.Event()
+        self._thread = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok = True)
+
+    def add_channel(self, name, read_function, period = 1.0):
+        self.channels[name] = (read_function, float(period))
+        self.buffers[name] = RingBuffer(self.capacity)
+        self.errors[name] = 0
+        if self.directory is not None:
+            self._files[name] = (open(os.path.join(self.directory, name + '.time.f8'), 'ab'),
+                                 open(os.path.join(self.directory, name + '.value.f8'), 'ab'))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target = self._run, name = 'TelemetryLogger', daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for time_file, value_file in self._files.values():
+            time_file.flush()
+            value_file.flush()
+
+    def close(self):
+        self.stop()
+        for time_file, value_file in self._files.values():
+            time_file.close()
+            value_file.close()
+        self._files = {}
+
+    def _poll(self, name):
+        read_function = self.channels[name][0]
+        try:
+            value = float(read_function())
+        except Exception:
+            self.errors[name] += 1
+            return
+        t = time.time()
+        self.buffers[name].append(t, value)
+        if name in self._files:
+            time_file, value_file = self._files[name]
+            time_file.write(np.float64(t).astype('<f8').tobytes())
+            value_file.write(np.float64(value).astype('<f8').tobytes())
+            time_file.flush()
+            value_file.flush()
+
+    def _run(self):
+        next_poll = {name : time.time() for name in self.channels}
+        while not self._stop.is_set():
+            now = time.time()
+            for name in list(self.channels):
+                if name not in next_poll:
+                    next_poll[name] = now # Channel added while running
+                if next_poll[name] <= now:
+                    self._poll(name)
+                    period = self.channels[name][1]
+                    # Skip missed slots rather than polling back-to-back to catch up
+                    next_poll[name] += period*(np.floor((time.time() - next_poll[name])/period) + 1)
+            wait_time = min(next_poll.values()) - time.time() if next_poll else 0.1
+            self._stop.wait(max(wait_time, 0))
+
+    def latest(self, name):
+        """ Returns (time, value) of the most recent reading of channel `name` """
+        return self.buffers[name].latest()
+
+    def value_at(self, name, t, interpolate = True):
+        """ Returns the value of channel `name` at time t (as from time.time()) """
+        return self.buffers[name].value_at(t, interpolate = interpolate)
+
+    def history(self, name):
+        """ Returns (times, values) of the buffered readings of channel `name` """
+        return self.buffers[name].history()
+
+
+def load_telemetry(directory):
+    """ Reads the columnar files written by a TelemetryLogger back into a
+    dictionary of {name : (times, values)} """
+    data = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.time.f8'):
+            continue
+        name = filename[:-len('.time.f8')]
+        times = np.fromfile(os.path.join(directory, filename), dtype = '<f8')
+        values = np.fromfile(os.path.join(directory, name + '.value.f8'), dtype = '<f8')
+        num_complete = min(len(times), len(values)) # Guard against a partially written last row
+        data[name] = (times[:num_complete], values[:num_complete])
+    return data
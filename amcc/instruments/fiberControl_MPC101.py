@@ -1,28 +1,14 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 
 
-class FiberControlMPC101:
+class FiberControlMPC101(GenericInstrument):
     """Class for controlling an MPC1 Polarization Controller."""
 
     axes = ['X', 'Y', 'Z']
     
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000  # Set response timeout (in milliseconds)
+        super().__init__(visa_name)
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, command):
-        self.pyvisa.write(command)
-    
-    def query(self, command):
-        return self.pyvisa.query(command)
-    
-    def close(self):
-        self.pyvisa.close()
-    
     def identify(self):
         return self.query('*IDN?')
     
@@ -1,26 +1,169 @@
+import threading
 import pyvisa as visa
 
+
+# Process-wide VISA transport pool.  Every instrument class shares a single
+# ResourceManager, and each VISA resource is opened at most once no matter how
+# many driver objects point at it (e.g. several SIM900 modules on one GPIB
+# mainframe).  Sessions are reference-counted and only closed when the last
+# driver using them calls close()
+_resource_manager = None
+_sessions = {} # Maps resource name -> [pyvisa session, reference count, lock]
+_pool_lock = threading.Lock()
+
+# Session attributes each driver can set for itself with set_session_attributes().
+# A shared session is switched to a driver's settings whenever that driver
+# takes the session lock after another driver used it
+SESSION_ATTRIBUTES = ('timeout', 'read_termination', 'write_termination', 'query_delay')
+_session_defaults = {} # Maps resource name -> attributes the session was opened with
+_session_owners = {} # Maps resource name -> driver whose settings are applied
+
+
+def get_resource_manager():
+    """ Returns the shared pyvisa ResourceManager, creating it on first use """
+    global _resource_manager
+    with _pool_lock:
+        if _resource_manager is None:
+            _resource_manager = visa.ResourceManager()
+        return _resource_manager
+
+
+def _resource_key(rm, visa_name):
+    """ Normalizes a VISA name so that e.g. 'GPIB0::24' and 'GPIB0::24::INSTR'
+    map onto the same pooled session """
+    try:
+        return rm.resource_info(visa_name).resource_name
+    except Exception:
+        return visa_name.upper()
+
+
+def acquire_resource(visa_name):
+    """ Returns (key, session, lock) for visa_name, opening the session only if
+    no other driver currently holds it """
+    rm = get_resource_manager()
+    key = _resource_key(rm, visa_name)
+    with _pool_lock:
+        if key in _sessions:
+            entry = _sessions[key]
+            entry[1] += 1
+            return key, entry[0], entry[2]
+        session = rm.open_resource(visa_name)
+        session.timeout = 5000 # Set response timeout (in milliseconds)
+        _sessions[key] = [session, 1, threading.RLock()]
+        _session_defaults[key] = {name : getattr(session, name) for name in SESSION_ATTRIBUTES
+                                  if hasattr(session, name)}
+        return key, session, _sessions[key][2]
+
+
+def release_resource(key):
+    """ Drops one reference to a pooled session, closing it when unused """
+    with _pool_lock:
+        entry = _sessions.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _sessions[key]
+            _session_defaults.pop(key, None)
+            _session_owners.pop(key, None)
+            entry[0].close()
+
+
+def open_session_count():
+    """ Number of VISA sessions currently held open by the pool """
+    with _pool_lock:
+        return len(_sessions)
+
+
+class _SessionLock(object):
+    """ The pooled session's lock as seen by one driver: taking it also
+    applies that driver's session attributes if another driver changed them """
+    def __init__(self, lock, instrument):
+        self._lock = lock
+        self._instrument = instrument
+
+    def acquire(self, *args, **kwargs):
+        acquired = self._lock.acquire(*args, **kwargs)
+        if acquired:
+            try:
+                self._instrument._claim_session()
+            except:
+                self._lock.release()
+                raise
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
 class GenericInstrument(object):
     """Python class for a generic SCPI-style instrument interface,
-    written by Adam McCaughan"""
+    written by Adam McCaughan.  All of the VISA drivers in amcc.instruments
+    inherit from this class so they share pooled VISA sessions.  Drivers set
+    their timeout / terminations / query_delay with set_session_attributes()
+    so that they don't leak into other drivers sharing the session, and make
+    temporary changes to self.pyvisa attributes only while holding self.lock"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
+        self.rm = get_resource_manager()
+        self.visa_name = visa_name
+        self._session_attributes = {}
+        self._visa_key, self.pyvisa, lock = acquire_resource(visa_name)
+        self.lock = _SessionLock(lock, self)
         # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
 
+    def set_session_attributes(self, **attributes):
+        """ Sets pyvisa session attributes (timeout, read_termination,
+        write_termination, query_delay) for this driver only, e.g.
+        set_session_attributes(timeout = 30000) """
+        for name in attributes:
+            if name not in SESSION_ATTRIBUTES:
+                raise ValueError('Session attribute must be one of %s' % (SESSION_ATTRIBUTES,))
+        with self.lock:
+            self._session_attributes.update(attributes)
+            for name, value in attributes.items():
+                setattr(self.pyvisa, name, value)
+
+    def _claim_session(self):
+        # Called with the session lock held
+        if (self.pyvisa is None) or (_session_owners.get(self._visa_key) is self):
+            return
+        attributes = dict(_session_defaults.get(self._visa_key, {}))
+        attributes.update(self._session_attributes)
+        for name, value in attributes.items():
+            setattr(self.pyvisa, name, value)
+        _session_owners[self._visa_key] = self
+
     def read(self):
-        return self.pyvisa.read()
-    
+        with self.lock:
+            return self.pyvisa.read()
+
+    def read_raw(self):
+        with self.lock:
+            return self.pyvisa.read_raw()
+
     def write(self, string):
-        self.pyvisa.write(string)
+        with self.lock:
+            self.pyvisa.write(string)
 
     def query(self, string):
-        return self.pyvisa.query(string)
+        with self.lock:
+            return self.pyvisa.query(string)
 
     def close(self):
-        self.pyvisa.close()
-        
+        if self.pyvisa is not None:
+            with _pool_lock:
+                if _session_owners.get(self._visa_key) is self:
+                    del _session_owners[self._visa_key]
+            release_resource(self._visa_key)
+            self.pyvisa = None
+
     def reset(self):
         self.write('*RST')
 
@@ -29,7 +172,3 @@ class GenericInstrument(object):
 
 # g = GenericInstrument('GPIB0::24')
 # g.identify()
-
-
-
-
@@ -1,27 +1,13 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 
-class HP3748A(object):
+class HP3748A(GenericInstrument):
     """Python class for HP 3478A Multimeter, written by Adam McCaughan"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+        super().__init__(visa_name)
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-        
     def identify(self):
         return self.query('*IDN?')
 
-    def close(self):
-        self.pyvisa.close()
         # Anything else here that needs to happen on initialization
     # def reset(self):
         # self.write('*RST')
@@ -1,35 +1,37 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 from time import sleep
 import numpy as np
 
-class HP8722C(object):
-    """Python class for HP 8722C Network Analyzer, written by Adam McCaughan"""
-    def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
+# Binary output formats: numpy dtype of each value.  Both send a 4-byte header
+# ('#A' and a 2-byte length) before the data
+DATA_FORMATS = {'FORM3' : '>f8', # IEEE 64-bit
+                'FORM5' : '<f4', # PC-DOS 32-bit (byte-reversed IEEE)
+                }
 
-    def query(self, string):
-        return self.pyvisa.query(string)
 
+class HP8722C(GenericInstrument):
+    """Python class for HP 8722C Network Analyzer, written by Adam McCaughan"""
+    def __init__(self, visa_name):
+        super().__init__(visa_name)
+        self._clear_settings()
+
+    def _clear_settings(self):
+        # Settings are cached once set (or first read back) so that repeated
+        # sweeps only cost the trigger and one binary transfer
+        self.f_start = None
+        self.f_stop = None
+        self.num_pts = None
+        self.display_format = None
+        self.data_format = None
     
     def reset(self):
         self.write('*RST')
-        self.timeout = 5
+        self._clear_settings()
         
     def identify(self):
         return self.query('*IDN?')
 
-    def close(self):
-        self.pyvisa.close()
-
 
     def freq_range(self, f_start = 0.1e9, f_stop = 1.0e9, f_center = None, f_span = None, num_pts = 401):
     
@@ -40,9 +42,14 @@ class HP8722C(object):
         self.write('POIN %0.0i;' % num_pts)
         self.write('STAR %0.6e;' % f_start)
         self.write('STOP %0.6e;' % f_stop)
+        # The NA only allows certain numbers of points and rounds the span, so
+        # cache what it actually applied
+        self.f_start = None
+        return self.get_sweep_settings()
 
     def fixed_freq(self, f = 10e6):
         self.write('CWFREQ%0.6eHZ;' % f)
+        self.f_start = None # Re-read the sweep settings on the next sweep
 
     def power(self, power = -20):
         if (power < -60) or (power > 0):
@@ -60,82 +67,88 @@ class HP8722C(object):
         self.write('%s;' % s_mode)
 
     def format_polar(self):
-        self.write('POLA') # Set to polar coordinates
+        if self.display_format != 'POLA':
+            self.write('POLA') # Set to polar coordinates
+            self.display_format = 'POLA'
 
     def format_logarithmic(self):
-        self.write('LOGM') # Set to polar coordinates
-
-
-    def run_sweep_ri(self):
+        if self.display_format != 'LOGM':
+            self.write('LOGM') # Set to logarithmic magnitude
+            self.display_format = 'LOGM'
+
+    def set_data_format(self, data_format = 'FORM3'):
+        """ Selects the binary output format, FORM3 (64-bit) or FORM5 (32-bit) """
+        if data_format not in DATA_FORMATS:
+            raise ValueError('data_format must be one of %s' % list(DATA_FORMATS))
+        if self.data_format != data_format:
+            self.write('%s;' % data_format)
+            self.data_format = data_format
+
+    def get_sweep_settings(self):
+        """ Returns (f_start, f_stop, num_pts), only asking the NA if they have not
+        been read already (freq_range() reads them back) """
+        if (self.f_start is None) or (self.f_stop is None) or (self.num_pts is None):
+            self.f_start = float(self.query('STAR?;'))
+            self.f_stop = float(self.query('STOP?;'))
+            self.num_pts = int(float(self.query('POIN?;')))
+        return self.f_start, self.f_stop, self.num_pts
+
+    def run_sweep(self, data_format = 'FORM3', timeout = 20, continuous = True):
+        """ Runs a single sweep using whatever settings are currently on the NA and
+        returns its formatted trace (OUTPFORM) as a complex numpy array, read in
+        the binary data_format 'FORM3' (64-bit) or 'FORM5' (32-bit).  In polar
+        format the real and imaginary parts are the real and imaginary
+        components, in log magnitude format the real part is the magnitude.  If
+        continuous is True the NA goes back to continuous sweeping afterwards """
+        f_start, f_stop, num_pts = self.get_sweep_settings()
+        self.set_data_format(data_format)
+        dtype = np.dtype(DATA_FORMATS[data_format])
+        with self.lock:
+            temp = self.pyvisa.timeout; self.pyvisa.timeout = timeout*1e3
+            try:
+                self.query('OPC?;SING;') # Runs a SINGle sweep, and waits for the OPeration to Complete
+                self.write('OUTPFORM;')
+                raw = self.read_raw()
+            finally:
+                self.pyvisa.timeout = temp
+        if raw[:2] != b'#A':
+            raise ValueError('Expected an #A binary block from OUTPFORM, got %r' % raw[:8])
+        num_values = int.from_bytes(raw[2:4], 'big')//dtype.itemsize # '#A' + 2-byte length header
+        if num_values != 2*num_pts:
+            raise ValueError('NA sent %i points, expected %i' % (num_values//2, num_pts))
+        data = np.frombuffer(raw, dtype = dtype, count = num_values, offset = 4)
+        S = data.astype(dtype.newbyteorder('=')).view(np.complex128 if dtype.itemsize == 8 else np.complex64)
+        if continuous:
+            self.write('CONT')
+        return S
+
+
+    def run_sweep_ri(self, data_format = 'FORM3'):
         """ Runs a sweep using whatever settings are currently on the NA and returns the real
         and imaginary components of each data point """
         self.format_polar() # Set to polar coordinates
-        f_start = float(self.query('STAR?;'))
-        f_span = float(self.query('SPAN?;'))
-        f_stop = float(self.query('STOP?;'))
-        num_pts = int(float(self.query('POIN?;')))
-
-        print('Sweeping from %0.0d MHz to %0.0d MHz, with %0.0d points' % (f_start/1e6, f_stop/1e6, num_pts))
-
-        temp = self.timeout; self.timeout = 20
-        completion = self.query('OPC?;SING;') # Runs a SINGle sweep, and waits for the OPeration to Complete
-        self.timeout = temp
-
-        self.write('FORM4;') # Make the data output in ASCII
-        data = self.ask_for_values('OUTPFORM;')
-
+        S = self.run_sweep(data_format = data_format)
+        f_start, f_stop, num_pts = self.get_sweep_settings()
         F = np.linspace(f_start, f_stop, num_pts, endpoint = True)
-        R = data[::2] # Every other element starting with element 0
-        I = data[1::2]
-        self.write('CONT')
-        return F, R, I
+        return F, S.real, S.imag
 
 
         
-    def run_sweep_mag(self):
-        """ Runs a sweep using whatever settings are currently on the NA and returns the real
-        and imaginary components of each data point """
+    def run_sweep_mag(self, data_format = 'FORM3'):
+        """ Runs a sweep using whatever settings are currently on the NA and returns the
+        log magnitude of each data point """
         self.format_logarithmic() # Set to logarithimic coordinates
-        f_start = float(self.query('STAR?;'))
-        f_span = float(self.query('SPAN?;'))
-        f_stop = float(self.query('STOP?;'))
-        num_pts = int(float(self.query('POIN?;')))
-
-        print('Sweeping from %0.0d MHz to %0.0d MHz, with %0.0d points' % (f_start/1e6, f_stop/1e6, num_pts))
-
-        temp = self.timeout; self.timeout = 20
-        completion = self.query('OPC?;SING;') # Runs a SINGle sweep, and waits for the OPeration to Complete
-        self.timeout = temp
-
-        self.write('FORM4;') # Make the data output in ASCII
-        data = self.ask_for_values('OUTPFORM;')
-
-        f = np.linspace(f_start, f_stop, num_pts, endpoint = True)
-        F = f[::1]
-        M = data[::2] # Every other element starting with element 0
-        self.write('CONT')
+        S = self.run_sweep(data_format = data_format)
+        f_start, f_stop, num_pts = self.get_sweep_settings()
+        F = np.linspace(f_start, f_stop, num_pts, endpoint = True)
+        M = S.real
         return F, M
 
-    def run_sweep_ri_logspace(self):
+    def run_sweep_ri_logspace(self, data_format = 'FORM3'):
         """ Runs a sweep using whatever settings are currently on the NA and returns the real
         and imaginary components of each data point """
         self.format_polar() # Set to polar coordinates
-        f_start = float(self.query('STAR?;'))
-        f_span = float(self.query('SPAN?;'))
-        f_stop = float(self.query('STOP?;'))
-        num_pts = int(float(self.query('POIN?;')))
-
-        print('Sweeping from %0.0d MHz to %0.0d MHz, with %0.0d points' % (f_start/1e6, f_stop/1e6, num_pts))
-
-        temp = self.timeout; self.timeout = 20
-        completion = self.query('OPC?;SING;') # Runs a SINGle sweep, and waits for the OPeration to Complete
-        self.timeout = temp
-
-        self.write('FORM4;') # Make the data output in ASCII
-        data = self.ask_for_values('OUTPFORM;')
-
+        S = self.run_sweep(data_format = data_format)
+        f_start, f_stop, num_pts = self.get_sweep_settings()
         F = np.logspace(np.log10(f_start), np.log10(f_stop), num_pts, endpoint = True)
-        R = data[::2] # Every other element starting with element 0
-        I = data[1::2]
-        self.write('CONT')
-        return F, R, I
+        return F, S.real, S.imag
@@ -1,28 +1,13 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 import time
 
-class JDSHA9(object):
+class JDSHA9(GenericInstrument):
     """Python class for JDS HJA9 Optical Attenuator, written by Adam McCaughan."""
 
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
-        
+        super().__init__(visa_name)
+
     def identify(self):
         return self.query('*IDN?')
 
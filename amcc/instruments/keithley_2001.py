@@ -1,24 +1,9 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 
-class Keithley2001(object):
+class Keithley2001(GenericInstrument):
     """Python class for Keithley 2001 Multimeter, written by Adam McCaughan"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+        super().__init__(visa_name)
 
 
         # Anything else here that needs to happen on initialization
@@ -1,43 +1,44 @@
 
 
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
+import numpy as np
 
-class Keithley2400(object):
-    """Python class for Keithley 2400 Sourcemeter, written by Adam McCaughan"""
-    def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
+# FORM:ELEM names and the fields they are returned as by read_measurements()
+FORMAT_ELEMENTS = {'VOLT' : 'voltage', 'CURR' : 'current', 'RES' : 'resistance',
+                   'TIME' : 'time', 'STAT' : 'status'}
+
+# Bits of the status word (see the :FORMat:ELEMents section of the manual)
+STATUS_FLAGS = {'overflow' : 0, 'compliance' : 3, 'over_voltage' : 4,
+                'range_compliance' : 16, 'contact_check_failed' : 18}
 
-    def query(self, string):
-        return self.pyvisa.query(string)
+class Keithley2400(GenericInstrument):
+    """Python class for Keithley 2400 Sourcemeter, written by Adam McCaughan"""
+    def __init__(self, visa_name):
+        super().__init__(visa_name)
+        self.format_elements = ('VOLT', 'CURR', 'RES', 'TIME', 'STAT') # Power-on default
+        self.binary_readings = False
+        self._trigger_count = None
 
     def reset(self):
         self.write('*RST')
+        self.format_elements = ('VOLT', 'CURR', 'RES', 'TIME', 'STAT')
+        self.binary_readings = False
+        self._trigger_count = None
         
     def identify(self):
         return self.query('*IDN?')
 
-    def close(self):
-        self.pyvisa.close()
-
 
     def setup_read_volt(self):
-        self.write('*RST')
+        self.reset()
         self.write(':SOUR:FUNC CURR')
         self.write(':SOUR:CURR:LEVEL 0E-6')
         self.write('SENS:FUNC \"VOLT\"')
 
 
     def setup_4W_source_I_read_V(self):
-        self.write('*RST')
+        self.reset()
         self.write(':SOUR:FUNC CURR') # Set operation mode to: source current
         self.write(':SOUR:CURR:LEVEL 0E-6') # Set current level to 0 uA
         self.write(':SYST:RSEN 1') # Turn on "Remote Sensing" aka 4-wire measurement mode
@@ -45,14 +46,14 @@ class Keithley2400(object):
 
 
     def setup_4W_source_V_read_I(self):
-        self.write('*RST')
+        self.reset()
         self.write(':SOUR:FUNC VOLT') # Set operation mode to: source voltage
         self.write(':SOUR:VOLT:LEVEL 0E-3') # Set voltage level to 0 mA
         self.write(':SYST:RSEN 1') # Turn on "Remote Sensing" aka 4-wire measurement mode
         self.write('SENS:FUNC \"VOLT\", \"CURR\"') # Have it output
 
     def setup_2W_source_I_read_V(self):
-        self.write('*RST')
+        self.reset()
         self.write(':SOUR:FUNC CURR') # Set operation mode to: source current
         self.write(':SOUR:CURR:LEVEL 0E-6') # Set current level to 0 uA
         self.write(':SYST:RSEN 0') # Turn off "Remote Sensing" aka 2-wire measurement mode
@@ -60,7 +61,7 @@ class Keithley2400(object):
 
 
     def setup_2W_source_V_read_I(self):
-        self.write('*RST')
+        self.reset()
         self.write(':SOUR:FUNC VOLT') # Set operation mode to: source voltage
         self.write(':SOUR:VOLT:LEVEL 0E-3') # Set voltage level to 0 mV
         self.write(':SYST:RSEN 0') # Turn off "Remote Sensing" aka 2-wire measurement mode
@@ -102,12 +103,14 @@ class Keithley2400(object):
 
 
     def read_voltage_and_current(self):
-        read_str = self.query(':READ?')
         # See page 18-51 of manual, returns: voltage, current, resistance, timestamp, status info
         # Returns something like '5.275894E-05,-1.508318E-06,+9.910000E+37,+2.562604E+03,+3.994000E+04'
-        data = read_str.split(',')
-        voltage, current = float(data[0]), float(data[1])
-        return voltage, current
+        # or the same values as binary floats after setup_binary_readings()
+        if not {'VOLT', 'CURR'} <= set(self.format_elements):
+            raise ValueError('read_voltage_and_current() needs VOLT and CURR in the format '
+                             'elements, they are %s (see setup_binary_readings)' % ','.join(self.format_elements))
+        m = self.read_measurements(num_readings = 1)[0]
+        return float(m['voltage']), float(m['current'])
 
 
     def read_current(self, current = 0e-6):
@@ -117,4 +120,118 @@ class Keithley2400(object):
 
     def read_voltage(self):
         voltage, current = self.read_voltage_and_current()
-        return voltage
\ No newline at end of file
+        return voltage
+
+
+    def setup_binary_readings(self, elements = ['VOLT', 'CURR', 'RES', 'TIME', 'STAT']):
+        """ Switches readings to little-endian 32-bit binary (FORM REAL,32 with
+        FORM:BORD SWAP) containing only `elements`, any of VOLT / CURR / RES / TIME / STAT """
+        elements = tuple(e.upper()[:4] for e in elements)
+        self.write(':FORM:DATA REAL,32')
+        self.write(':FORM:BORD SWAP')
+        self.write(':FORM:ELEM %s' % ','.join(elements))
+        self.format_elements = elements
+        self.binary_readings = True
+
+
+    def setup_ascii_readings(self):
+        self.write(':FORM:DATA ASC')
+        self.binary_readings = False
+
+
+    def measurement_dtype(self):
+        """ numpy dtype of the structured arrays returned by read_measurements() """
+        fields = [(FORMAT_ELEMENTS[e], np.float64) for e in self.format_elements if e != 'STAT']
+        if 'STAT' in self.format_elements:
+            fields += [('status', np.uint32)] + [(flag, np.bool_) for flag in STATUS_FLAGS]
+        return np.dtype(fields)
+
+
+    def read_measurements(self, num_readings = 1, out = None, timeout = None):
+        """ Takes num_readings readings (using :TRIG:COUN) with a single :READ?
+        and returns them as a structured numpy array with one field per FORM:ELEM
+        element.  If the status word is included, the compliance / overflow bits are
+        decoded into boolean fields (see STATUS_FLAGS).  Binary replies (see
+        setup_binary_readings) are parsed with np.frombuffer, ASCII replies also
+        work.  `out` can be a preallocated array of dtype measurement_dtype().
+        timeout (in seconds) raises the VISA timeout for long acquisitions """
+        with self.lock:
+            if num_readings != self._trigger_count:
+                self.write(':TRIG:COUN %d' % num_readings)
+                self._trigger_count = num_readings
+            temp = self.pyvisa.timeout
+            if timeout is not None: self.pyvisa.timeout = timeout*1e3
+            try:
+                self.write(':READ?')
+                raw = self.read_raw()
+            finally:
+                self.pyvisa.timeout = temp
+
+        num_elements = len(self.format_elements)
+        if raw[:1] == b'#':
+            # Keithley sends an indefinite-length '#0' block header
+            values = np.frombuffer(raw, dtype = '<f4', count = num_readings*num_elements, offset = 2)
+        else:
+            values = np.array(raw.decode().strip().split(','), dtype = np.float64)
+        values = values.reshape(-1, num_elements)
+
+        if out is None:
+            out = np.empty(len(values), dtype = self.measurement_dtype())
+        for i, element in enumerate(self.format_elements):
+            out[FORMAT_ELEMENTS[element]] = values[:,i]
+        if 'STAT' in self.format_elements:
+            status = out['status']
+            for flag, bit in STATUS_FLAGS.items():
+                out[flag] = (status >> bit) & 1
+        return out
+
+
+    def sweep(self, values = None, start = None, stop = None, num_points = 100, spacing = 'LIN',
+              source = 'CURR', source_delay = 0, timeout = 60):
+        """ Runs a whole IV sweep on the instrument and reads every point back in a
+        single binary transfer.  Either give the source values explicitly with
+        `values`, or give start/stop/num_points with spacing 'LIN' or 'LOG'.
+        source is 'CURR' or 'VOLT'.  The values are loaded into the source list
+        memory (:SOUR:LIST, up to 2500 points, longer sweeps run in chunks) and
+        triggered with :TRIG:COUN.  The output should already be configured and on
+        (e.g. with setup_2W_source_I_read_V() and set_output(True)).
+        Returns a dictionary of numpy arrays: 'voltage', 'current', 'resistance',
+        'time', 'status' and 'compliance' """
+        if values is None:
+            if spacing.upper() == 'LOG':
+                values = np.geomspace(start, stop, int(num_points))
+            else:
+                values = np.linspace(start, stop, int(num_points))
+        values = np.asarray(values, dtype = np.float64).ravel()
+        if len(values) == 0:
+            raise ValueError('sweep() needs at least one source value')
+        source = source.upper()[:4]
+
+        previous_elements, previous_binary = self.format_elements, self.binary_readings
+        self.setup_binary_readings(elements = ['VOLT', 'CURR', 'RES', 'TIME', 'STAT'])
+        try:
+            self.write(':SOUR:FUNC %s' % source)
+            self.write(':SOUR:%s:MODE LIST' % source)
+            self.write(':SOUR:DEL %0.4e' % source_delay)
+
+            data = []
+            for chunk in np.array_split(values, int(np.ceil(len(values)/2500))):
+                # :SOUR:LIST accepts at most 100 values per command, the rest are appended
+                for n in range(0, len(chunk), 100):
+                    list_str = ','.join('%0.6e' % v for v in chunk[n:n+100])
+                    if n == 0: self.write(':SOUR:LIST:%s %s' % (source, list_str))
+                    else:      self.write(':SOUR:LIST:%s:APP %s' % (source, list_str))
+                data.append(self.read_measurements(num_readings = len(chunk), timeout = timeout))
+        finally:
+            # Leave the source and reading format as they were, even if the sweep failed
+            self.write(':SOUR:%s:MODE FIX' % source)
+            self.write(':TRIG:COUN 1') # Leave the trigger count at 1 for single readings
+            self._trigger_count = 1
+            if previous_binary:
+                self.setup_binary_readings(elements = previous_elements)
+            else:
+                self.write(':FORM:ELEM %s' % ','.join(previous_elements))
+                self.setup_ascii_readings()
+
+        data = np.concatenate(data)
+        return {name : data[name] for name in ['voltage', 'current', 'resistance', 'time', 'status', 'compliance']}
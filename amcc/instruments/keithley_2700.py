@@ -1,36 +1,166 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
+import numpy as np
+import time
+
+# Maximum number of readings the 2700 reading buffer can hold
+BUFFER_SIZE = 55000
 
-class Keithley2700(object):
-    """Python class for Keithley 2700 Data Acquisition System, written by Adam McCaughan"""
-    def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
+def channel_list(channels):
+    """ Converts a list of channel numbers such as [101, 102, 110] into the SCPI
+    channel list '(@101,102,110)'.  Strings are passed through unchanged """
+    if isinstance(channels, str):
+        return channels
+    return '(@%s)' % ','.join('%d' % c for c in channels)
 
-    def query(self, string):
-        return self.pyvisa.query(string)
 
-    def close(self):
-        self.pyvisa.close()
+class Keithley2700(GenericInstrument):
+    """Python class for Keithley 2700 Data Acquisition System, written by Adam McCaughan"""
+    def __init__(self, visa_name):
+        super().__init__(visa_name)
+        self.scan_channels = None
 
         
     def reset(self):
         self.write('*RST')
+        self.scan_channels = None
         
     def identify(self):
         return self.query('*IDN?')
         
     def read_voltage(self):
-        read_str = self.query(':READ?')
+        with self.lock:
+            self.write(':READ?')
+            raw = self.read_raw()
+        if raw[:1] == b'#':
+            # Binary reply (after setup_scan), reading is the first element
+            return float(np.frombuffer(raw, dtype = '<f8', count = 1, offset = 2)[0])
         # Returns something like '+1.99919507E-01VDC,+6283.313SECS,+60584RDNG#'
-        E_location = read_str.find('E') # Finds location of E in read value
-        voltage_str = read_str[0 : read_str.find('E')+4]
-        return float(voltage_str) # Return just the first number (voltage)
-        
\ No newline at end of file
+        read_str = raw.decode().split(',')[0]
+        return float(read_str.rstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ#\r\n').rstrip()) # Return just the first number (voltage)
+
+
+    def setup_scan(self, channels = [101, 102], function = 'VOLT:DC', num_scans = 1,
+                   scan_interval = None, nplc = None):
+        """ Sets up the multiplexer card to scan `channels` (a list of channel
+        numbers, e.g. [101, 102, 103] or range(101, 111)) on the instrument,
+        num_scans times.  Each scan is one trigger: back-to-back by
+        default, or every scan_interval seconds using the trigger timer.  Readings
+        are stored in the reading buffer along with their timestamp and channel
+        number and are transferred as little-endian 64-bit binary """
+        if isinstance(channels, str):
+            raise ValueError('setup_scan() needs the channels as a list of channel numbers')
+        channels = list(channels)
+        ch_list = channel_list(channels)
+        self.write(':ABOR')
+        self.write(':INIT:CONT OFF')
+        self.write(':TRAC:CLE')
+        self.write(":FUNC '%s',%s" % (function, ch_list))
+        if nplc is not None:
+            self.write(':%s:NPLC %s,%s' % (function, nplc, ch_list))
+        self.write(':FORM:DATA DREAL')
+        self.write(':FORM:BORD SWAP')
+        self.write(':FORM:ELEM READ,TST,CHAN')
+        self.write(':TRAC:TST:FORM ABS')
+        self.write(':ROUT:SCAN %s' % ch_list)
+        self.write(':ROUT:SCAN:TSO IMM')
+        self.write(':ROUT:SCAN:LSEL INT')
+        self.write(':SAMP:COUN %d' % len(channels))
+        if scan_interval is None:
+            self.write(':TRIG:SOUR IMM')
+        else:
+            self.write(':TRIG:SOUR TIM')
+            self.write(':TRIG:TIM %0.3f' % scan_interval)
+        self.write(':TRIG:COUN %d' % num_scans)
+        self.write(':TRAC:POIN %d' % (len(channels)*num_scans))
+        self.write(':TRAC:FEED SENS')
+        self.write(':TRAC:FEED:CONT NEXT')
+        self.scan_channels = channels
+        self.num_scans = num_scans
+
+
+    def _parse_buffer(self, raw):
+        """ Converts a TRAC:DATA? reply into an (N, 3) array of reading,
+        timestamp and channel number """
+        if raw[:1] == b'#':
+            # Keithley sends an indefinite-length '#0' block header
+            values = np.frombuffer(raw, dtype = '<f8', count = (len(raw) - 2)//8, offset = 2)
+        else:
+            values = np.array(raw.decode().strip().split(','), dtype = np.float64)
+        return values.reshape(-1, 3)
+
+
+    def _fetch_buffer(self, start = None, count = None):
+        with self.lock:
+            if start is None:
+                self.write(':TRAC:DATA?')
+            else:
+                self.write(':TRAC:DATA:SEL? %d,%d' % (start, count))
+            return self._parse_buffer(self.read_raw())
+
+
+    def _scan_arrays(self, values):
+        num_channels = len(self.scan_channels)
+        values = values[:len(values) - len(values) % num_channels]
+        return {'channels' : values[:num_channels,2].astype(int),
+                'readings' : values[:,0].reshape(-1, num_channels),
+                'time' : values[:,1].reshape(-1, num_channels)}
+
+
+    def scan(self, timeout = 60):
+        """ Runs the scans set up with setup_scan() and reads the whole reading
+        buffer back in a single transfer.  Returns a dictionary with 'channels'
+        (the channel numbers, in scan order) and 'readings' and 'time' arrays of
+        shape (num_scans, num_channels) """
+        with self.lock:
+            temp = self.pyvisa.timeout; self.pyvisa.timeout = timeout*1e3
+            try:
+                self.write(':INIT')
+                self.query('*OPC?')
+                values = self._fetch_buffer()
+            finally:
+                self.pyvisa.timeout = temp
+        return self._scan_arrays(values)
+
+
+    def stream_scans(self, max_scans = None, poll_interval = 0.5):
+        """ Generator that scans continuously (after setup_scan()) and yields a
+        dictionary like scan() for each batch of new complete scans.  The reading
+        buffer is used as a circular buffer, so poll_interval must be short enough
+        that it does not fill up between polls.  Stops after max_scans scans
+        (None streams until the generator is closed), then aborts the scan and
+        restores the setup_scan() trigger count and buffer so scan() works again """
+        num_channels = len(self.scan_channels)
+        buffer_size = (BUFFER_SIZE//num_channels)*num_channels
+        self.write(':TRIG:COUN INF')
+        self.write(':TRAC:CLE')
+        self.write(':TRAC:POIN %d' % buffer_size)
+        self.write(':TRAC:FEED:CONT ALW')
+        self.write(':INIT')
+        read_position = 0
+        num_scans = 0
+        try:
+            while (max_scans is None) or (num_scans < max_scans):
+                time.sleep(poll_interval)
+                next_position = int(self.query(':TRAC:NEXT?'))
+                num_new = (next_position - read_position) % buffer_size
+                num_new -= num_new % num_channels # Only whole scans
+                if max_scans is not None:
+                    num_new = min(num_new, (max_scans - num_scans)*num_channels)
+                if num_new == 0:
+                    continue
+                # The new readings may wrap around the end of the buffer
+                first = min(num_new, buffer_size - read_position)
+                values = self._fetch_buffer(read_position, first)
+                if first < num_new:
+                    values = np.concatenate([values, self._fetch_buffer(0, num_new - first)])
+                read_position = (read_position + num_new) % buffer_size
+                num_scans += num_new//num_channels
+                yield self._scan_arrays(values)
+        finally:
+            self.write(':ABOR')
+            self.write(':TRAC:FEED:CONT NEV')
+            self.write(':TRAC:CLE')
+            self.write(':TRIG:COUN %d' % self.num_scans)
+            self.write(':TRAC:POIN %d' % (num_channels*self.num_scans))
+            self.write(':TRAC:FEED:CONT NEXT')
@@ -1,38 +1,362 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import numpy as np
 import time
 import datetime
-
-class LeCroy620Zi(object):
+import asyncio
+import contextlib
+import warnings
+
+
+# Layout of the 346-byte LECROY_2_3 WAVEDESC block, see the "Template" section
+# of the Remote Control Manual (query it on the scope with TMPL?).  Every field
+# of the descriptor is decoded in a single np.frombuffer call
+WAVEDESC_DTYPE = np.dtype([
+    ('descriptor_name', 'S16'),
+    ('template_name', 'S16'),
+    ('comm_type', '<i2'),           # 0 = BYTE, 1 = WORD
+    ('comm_order', '<i2'),          # 0 = HIFIRST, 1 = LOFIRST
+    ('wave_descriptor', '<i4'),     # Lengths (in bytes) of the blocks that follow
+    ('user_text', '<i4'),
+    ('res_desc1', '<i4'),
+    ('trigtime_array', '<i4'),
+    ('ris_time_array', '<i4'),
+    ('res_array1', '<i4'),
+    ('wave_array_1', '<i4'),
+    ('wave_array_2', '<i4'),
+    ('res_array2', '<i4'),
+    ('res_array3', '<i4'),
+    ('instrument_name', 'S16'),
+    ('instrument_number', '<i4'),
+    ('trace_label', 'S16'),
+    ('reserved1', '<i2'),
+    ('reserved2', '<i2'),
+    ('wave_array_count', '<i4'),    # Number of data points in the data array
+    ('pnts_per_screen', '<i4'),
+    ('first_valid_pnt', '<i4'),
+    ('last_valid_pnt', '<i4'),
+    ('first_point', '<i4'),
+    ('sparsing_factor', '<i4'),
+    ('segment_index', '<i4'),
+    ('subarray_count', '<i4'),
+    ('sweeps_per_acq', '<i4'),
+    ('points_per_pair', '<i2'),
+    ('pair_offset', '<i2'),
+    ('vertical_gain', '<f4'),
+    ('vertical_offset', '<f4'),
+    ('max_value', '<f4'),
+    ('min_value', '<f4'),
+    ('nominal_bits', '<i2'),
+    ('nom_subarray_count', '<i2'),
+    ('horiz_interval', '<f4'),
+    ('horiz_offset', '<f8'),
+    ('pixel_offset', '<f8'),
+    ('vertunit', 'S48'),
+    ('horunit', 'S48'),
+    ('horiz_uncertainty', '<f4'),
+    ('trigger_time_seconds', '<f8'),
+    ('trigger_time_minutes', 'u1'),
+    ('trigger_time_hours', 'u1'),
+    ('trigger_time_days', 'u1'),
+    ('trigger_time_months', 'u1'),
+    ('trigger_time_year', '<i2'),
+    ('trigger_time_unused', '<i2'),
+    ('acq_duration', '<f4'),
+    ('record_type', '<i2'),
+    ('processing_done', '<i2'),
+    ('reserved5', '<i2'),
+    ('ris_sweeps', '<i2'),
+    ('timebase', '<i2'),
+    ('vert_coupling', '<i2'),
+    ('probe_att', '<f4'),
+    ('fixed_vert_gain', '<i2'),
+    ('bandwidth_limit', '<i2'),
+    ('vertical_vernier', '<f4'),
+    ('acq_vert_offset', '<f4'),
+    ('wave_source', '<i2'),
+])
+
+
+def parse_wavedesc(databytes, offset = 0):
+    """ Decodes the WAVEDESC block starting at `offset` in `databytes` into a
+    numpy structured scalar.  The byte order is taken from the COMM_ORDER field
+    so this works regardless of the scope's COMM_ORDER setting """
+    # COMM_ORDER is 1 (LOFIRST) or 0 (HIFIRST), so its low byte is nonzero only for little-endian
+    little_endian = (databytes[offset + 34] != 0)
+    dtype = WAVEDESC_DTYPE if little_endian else WAVEDESC_DTYPE.newbyteorder('>')
+    return np.frombuffer(databytes, dtype = dtype, count = 1, offset = offset)[0]
+
+
+def _block_start(databytes, pos = 0):
+    """ Finds the IEEE 488.2 definite-length block header (such as '#9000123456')
+    at or after `pos`, and returns (index of first data byte, data length) """
+    n = databytes.index(b'#', pos)
+    num_digits = int(chr(databytes[n+1]))
+    length = int(databytes[n+2:n+2+num_digits])
+    return n + 2 + num_digits, length
+
+
+def split_waveforms(databytes, out_of_range_as_nan = True):
+    """ Parses a reply containing several concatenated WAVEFORM? blocks (e.g.
+    the answer to 'C1:WF?;C2:WF?') into a list of LeCroyWaveforms, all of which
+    are views into the one `databytes` buffer """
+    waveforms = []
+    pos = 0
+    while databytes.find(b'#', pos) >= 0:
+        start, length = _block_start(databytes, pos)
+        if start + length > len(databytes):
+            break # Incomplete block
+        waveforms.append(LeCroyWaveform(databytes, out_of_range_as_nan = out_of_range_as_nan, offset = pos))
+        pos = start + length
+    return waveforms
+
+
+class LeCroyWaveform(object):
+    """ A waveform as returned by the scope's WAVEFORM? query.  Holds a
+    zero-copy view of the raw ADC samples (`raw`) alongside the decoded WAVEDESC
+    (`desc`).  Scaled voltages and the time axis are only computed when asked
+    for, either via the cached `x` / `y` attributes or into a caller-supplied
+    buffer with get_times(out) / get_voltages(out).  Sequence (segmented)
+    acquisitions are exposed through get_segments() and `trigger_times` """
+
+    def __init__(self, databytes, out_of_range_as_nan = True, offset = 0):
+        start, block_length = _block_start(databytes, offset)
+        self.desc = parse_wavedesc(databytes, offset = start)
+        d = self.desc
+        self.vgain = float(d['vertical_gain'])
+        self.voffset = float(d['vertical_offset'])
+        self.hinterval = float(d['horiz_interval'])
+        self.hoffset = float(d['horiz_offset'])
+        self.out_of_range_as_nan = out_of_range_as_nan
+
+        byteorder = d.dtype['comm_order'].byteorder
+
+        # Sequence acquisitions carry one (trigger time, trigger offset) pair of
+        # doubles per segment in the TRIGTIME block, which follows USER_TEXT
+        trigtime_start = start + int(d['wave_descriptor']) + int(d['user_text'])
+        trigtime_dtype = np.dtype([('trigger_time', 'f8'), ('trigger_offset', 'f8')]).newbyteorder(byteorder)
+        self.trigtimes = np.frombuffer(databytes, dtype = trigtime_dtype,
+                                       count = int(d['trigtime_array']) // trigtime_dtype.itemsize,
+                                       offset = trigtime_start)
+        self.num_segments = max(len(self.trigtimes), 1)
+
+        # The data array follows WAVEDESC, USER_TEXT, TRIGTIME and RIS_TIME blocks
+        data_start = trigtime_start + int(d['trigtime_array']) + int(d['ris_time_array'])
+        # COMM_FORMAT BYTE sends the 8-bit ADC code directly, WORD left-justifies it in 16 bits.
+        # VERTICAL_GAIN is always per LSB of the transferred type so scaling is identical
+        if int(d['comm_type']) == 0:
+            sample_dtype = np.dtype('i1')
+            self._max_code, self._min_code = 127, -128
+        else:
+            sample_dtype = np.dtype('i2').newbyteorder(byteorder)
+            # Not sure why this is 2**15 - 2**8 but that's the maximum number on the Lecroy Wavepro 7100
+            self._max_code, self._min_code = 32512, -32768
+        num_samples = int(d['wave_array_1']) // sample_dtype.itemsize
+        num_samples = min(num_samples, (min(len(databytes), start + block_length) - data_start) // sample_dtype.itemsize)
+        self.raw = np.frombuffer(databytes, dtype = sample_dtype, count = num_samples, offset = data_start)
+
+        num_points = min(num_samples, int(d['wave_array_count']))
+        if self.num_segments > 1:
+            self.samples_per_segment = num_points // self.num_segments
+            num_points = self.samples_per_segment * self.num_segments
+        else:
+            # Clip to # of points on scope, otherwise have array problems with scope returning e.g. 1,001 vs 1,002 points
+            if int(d['pnts_per_screen']) > 0:
+                num_points = min(num_points, int(d['pnts_per_screen']))
+            self.samples_per_segment = num_points
+        self.raw = self.raw[:num_points]
+        self._x = None
+        self._y = None
+
+    def __len__(self):
+        return len(self.raw)
+
+    def get_times(self, out = None):
+        """ Computes the time axis (of a single segment, for sequence
+        acquisitions), writing into `out` if it is given """
+        n = self.samples_per_segment
+        if out is None:
+            out = np.arange(n, dtype = np.float64)
+        else:
+            out = out[:n]
+            out[:] = np.arange(n, dtype = out.dtype)
+        out *= self.hinterval
+        out += self.hoffset
+        return out
+
+    def get_voltages(self, out = None):
+        """ Computes scaled voltages, writing into `out` if it is given.  If
+        out_of_range_as_nan is set, clipped ADC codes are replaced with NaN """
+        n = len(self.raw)
+        if out is None:
+            out = np.empty(n, dtype = np.float64)
+        else:
+            out = out[:n]
+        np.multiply(self.raw, self.vgain, out = out, casting = 'unsafe')
+        out -= self.voffset
+        if self.out_of_range_as_nan:
+            out[(self.raw >= self._max_code) | (self.raw == self._min_code)] = np.nan
+        return out
+
+    def get_segments(self, out = None):
+        """ Returns the scaled voltages as a (segments x samples) array """
+        if out is not None:
+            out = out.reshape(-1)
+        y = self.get_voltages(out) if out is not None or self._y is None else self._y
+        return y.reshape(self.num_segments, self.samples_per_segment)
+
+    @property
+    def trigger_times(self):
+        """ Time of each segment's trigger relative to the first, in seconds """
+        return self.trigtimes['trigger_time']
+
+    @property
+    def trigger_offsets(self):
+        """ Time from each segment's trigger to its first sample, in seconds """
+        return self.trigtimes['trigger_offset']
+
+    @property
+    def x(self):
+        if self._x is None:
+            self._x = self.get_times()
+        return self._x
+
+    @property
+    def y(self):
+        if self._y is None:
+            self._y = self.get_voltages()
+        return self._y
+
+class RunningStatistics(object):
+    """ Fixed-memory accumulator for a stream of values (e.g. pulse amplitudes
+    or jitter).  Keeps the count, min/max, mean and variance (Welford's
+    algorithm, merged batch-wise) and a fixed-bin histogram from which
+    percentiles are interpolated.  If bin_range is None it is set from the
+    first batch, padded by half its span on either side.  Values outside the
+    histogram range are tallied in num_underflow / num_overflow """
+
+    def __init__(self, num_bins = 1000, bin_range = None):
+        self.num_bins = num_bins
+        self.bin_edges = None if bin_range is None else np.linspace(bin_range[0], bin_range[1], num_bins + 1)
+        self.counts = np.zeros(num_bins, dtype = np.int64)
+        self.num_underflow = 0
+        self.num_overflow = 0
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """ Adds a batch of values (NaNs are ignored) """
+        values = np.asarray(values, dtype = np.float64).ravel()
+        values = values[np.isfinite(values)]
+        n = len(values)
+        if n == 0:
+            return
+        # Chan et al. parallel form of Welford's algorithm
+        batch_mean = values.mean()
+        batch_m2 = np.sum((values - batch_mean)**2)
+        delta = batch_mean - self.mean
+        total = self.count + n
+        self.mean += delta*n/total
+        self._m2 += batch_m2 + delta**2*self.count*n/total
+        self.count = total
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        if self.bin_edges is None:
+            lo, hi = values.min(), values.max()
+            pad = 0.5*(hi - lo) if hi > lo else max(abs(lo), 1e-12)
+            self.bin_edges = np.linspace(lo - pad, hi + pad, self.num_bins + 1)
+        self.num_underflow += int(np.count_nonzero(values < self.bin_edges[0]))
+        self.num_overflow += int(np.count_nonzero(values > self.bin_edges[-1]))
+        self.counts += np.histogram(values, bins = self.bin_edges)[0]
+
+    @property
+    def variance(self):
+        return self._m2/(self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def percentile(self, q):
+        """ Estimates the q-th percentile(s) (0-100) from the histogram, interpolating
+        linearly within a bin.  Out-of-range values count towards the ends """
+        q = np.asarray(q, dtype = np.float64)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        cumulative = self.num_underflow + np.concatenate([[0], np.cumsum(self.counts)])
+        target = q/100*self.count
+        return np.interp(target, cumulative, self.bin_edges)
+
+    def histogram(self):
+        """ Returns (counts, bin_edges) """
+        return self.counts, self.bin_edges
+
+
+def _crossing_times(x, Y, levels, stop_index):
+    """ For each row of Y, linearly interpolates the time at which it first rises
+    through levels[row] at or before stop_index[row].  NaN where there is no crossing """
+    idx = np.arange(Y.shape[1])
+    above = (Y >= levels[:,None]) & (idx[None,:] <= stop_index[:,None])
+    i = np.argmax(above, axis = 1)
+    rows = np.arange(Y.shape[0])
+    valid = above[rows, i] & (i > 0)
+    i = np.maximum(i, 1)
+    y0, y1 = Y[rows, i-1], Y[rows, i]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        frac = (levels - y0)/(y1 - y0)
+    t = x[i-1] + frac*(x[i] - x[i-1])
+    t[~valid] = np.nan
+    return t
+
+
+def pulse_parameters(x, Y, Y_reference = None, baseline_fraction = 0.1, threshold = 0.5):
+    """ Vectorized pulse measurements over a batch of positive-going pulses.
+    x is the shared time axis and Y is a (pulses x samples) array, e.g. from
+    LeCroyWaveform.get_segments().  The baseline is the median of the first
+    baseline_fraction of each record.  Returns a dictionary of per-pulse arrays:
+    'baseline', 'amplitude', 'rise_time' (10%-90%) and 'arrival_time' (the
+    `threshold` fraction crossing).  If Y_reference is given (same shape, e.g.
+    a clock or laser sync channel) 'jitter' is the arrival time relative to
+    the reference's own arrival time.  Pulses that are entirely NaN (e.g.
+    clipped segments) give NaN for every parameter """
+    Y = np.atleast_2d(Y)
+    num_baseline = max(int(Y.shape[1]*baseline_fraction), 1)
+    all_nan = np.all(np.isnan(Y), axis = 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # All-NaN slices
+        baseline = np.nanmedian(Y[:, :num_baseline], axis = 1)
+    peak_index = np.nanargmax(np.where(all_nan[:,None], 0, Y), axis = 1)
+    amplitude = Y[np.arange(Y.shape[0]), peak_index] - baseline
+    amplitude[all_nan] = np.nan
+    t10 = _crossing_times(x, Y, baseline + 0.1*amplitude, peak_index)
+    t90 = _crossing_times(x, Y, baseline + 0.9*amplitude, peak_index)
+    arrival_time = _crossing_times(x, Y, baseline + threshold*amplitude, peak_index)
+    params = {'baseline' : baseline, 'amplitude' : amplitude,
+              'rise_time' : t90 - t10, 'arrival_time' : arrival_time}
+    if Y_reference is not None:
+        reference = pulse_parameters(x, Y_reference, baseline_fraction = baseline_fraction, threshold = threshold)
+        params['jitter'] = arrival_time - reference['arrival_time']
+    return params
+
+
+class LeCroy620Zi(GenericInstrument):
     """Python class for LeCroy Oscilloscope, written by Adam McCaughan.  Most of these commands
     originate from the Automation Command Reference Manual for WaveRunner Oscilloscopes"""
 
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 10000 # Set response timeout (in milliseconds)
+        super().__init__(visa_name)
+        self.set_session_attributes(timeout = 10000) # Set response timeout (in milliseconds)
         # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+        self._vbs_batch = None # List of queued VBS statements while inside batch()
         self.write('COMM_HEADER OFF') # Get rid of the leading 'VBS ' crap
-        self.write('COMM_FORMAT DEF9,WORD,BIN') # Set output to 16 bits of information (a 'word') per datapoint
-
-    def read(self):
-        return self.pyvisa.read()
-
-    def read_raw(self):
-        return self.pyvisa.read_raw()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
+        self.set_comm_format('WORD') # Set output to 16 bits of information (a 'word') per datapoint
 
-    def query(self, string):
-        return self.pyvisa.query(string)
-        
     def identify(self):
         return self.query('*IDN?')
 
-    def close(self):
-        self.pyvisa.close()
-
 
     def round_up_lockstep(self, x):
         """ Some functions on the LeCroy require numbers to be rounded up to nearest 1,2 or 5
@@ -48,6 +372,29 @@ class LeCroy620Zi(object):
 
 
 
+    # batch() holds self.lock for its whole block, so checking and using
+    # _vbs_batch under the lock means only the thread running the batch sees it
+    def write(self, string):
+        with self.lock:
+            self.flush_batch() # Queued VBS statements must run first
+            super().write(string)
+
+    def query(self, string):
+        with self.lock:
+            self.flush_batch()
+            return super().query(string)
+
+    def read(self):
+        with self.lock:
+            self.flush_batch()
+            return super().read()
+
+    def read_raw(self):
+        with self.lock:
+            self.flush_batch()
+            return super().read_raw()
+
+
     def vbs_ask(self,message):
         vbs_msg = 'VBS? \'return = %s\'' % message
         # print 'Sending command:  ' + vbs_msg
@@ -55,18 +402,74 @@ class LeCroy620Zi(object):
 
 
     def vbs_write(self,message):
-        vbs_msg = 'VBS \'%s\'' % message
-        # print 'Sending command:  ' + vbs_msg
-        self.write(vbs_msg)
+        with self.lock:
+            if self._vbs_batch is not None:
+                self._vbs_batch.append(message)
+                return
+            vbs_msg = 'VBS \'%s\'' % message
+            # print 'Sending command:  ' + vbs_msg
+            self.write(vbs_msg)
+
+
+    @contextlib.contextmanager
+    def batch(self, max_length = 4000):
+        """ Collects every vbs_write inside the block and sends them as one
+        multi-statement VBS script (statements separated by ':') when the block
+        exits, so e.g. a whole measurement setup costs one network write:
+
+            with scope.batch():
+                scope.set_trigger(...)
+                scope.set_parameter(...)
+
+        Scripts longer than max_length characters are split into several writes.
+        Batches can be nested, only the outermost one sends.  If the block raises,
+        the queued statements are discarded """
+        with self.lock: # Other threads wait until the batch has been sent
+            if self._vbs_batch is not None: # Already inside a batch
+                yield
+                return
+            self._vbs_batch = []
+            try:
+                yield
+                self.flush_batch(max_length = max_length)
+            finally:
+                self._vbs_batch = None
+
+
+    def flush_batch(self, max_length = 4000):
+        """ Sends any VBS statements queued by batch() immediately (any other
+        traffic sent inside batch() does this first, so it stays in order) """
+        with self.lock:
+            if not self._vbs_batch:
+                return
+            statements, self._vbs_batch[:] = list(self._vbs_batch), []
+            script = ''
+            for statement in statements:
+                if script and (len(script) + len(statement) + 3 > max_length):
+                    super().write('VBS \'%s\'' % script)
+                    script = ''
+                script = statement if not script else script + ' : ' + statement
+            super().write('VBS \'%s\'' % script)
 
 
     def reset(self):
         self.write('*RST')
         self.write('COMM_HEADER OFF') # Get rid of the leading 'VBS ' crap
-        self.write('COMM_FORMAT DEF9,WORD,BIN') # Set output to 16 bits of information (a word) per sample
+        self.set_comm_format('WORD') # Set output to 16 bits of information (a word) per sample
         time.sleep(1)
 
 
+    def set_comm_format(self, sample_width = 'WORD'):
+        """ sample_width should be either WORD (16 bits per sample) or BYTE (8 bits
+        per sample).  The ADC is 8 bits so BYTE halves the transfer size of raw
+        channels, but math traces (averages, histograms, etc) lose resolution """
+        sample_width = sample_width.upper()
+        if sample_width not in ('WORD', 'BYTE'):
+            raise ValueError('sample_width must be WORD or BYTE')
+        self.write('COMM_FORMAT DEF9,%s,BIN' % sample_width)
+        self.comm_format = sample_width
+
+
     def clear_sweeps(self):
         self.vbs_write('app.ClearSweeps') #
         time.sleep(0.2) # Necessary to allow the scope time to reset all values
@@ -98,18 +501,20 @@ class LeCroy620Zi(object):
 
 
     def set_vertical_scale(self, channel = 'C1', volts_per_div = 1, volt_offset = 0):
-        # Lecroy only allows digits 1, 2, and 5.  e.g. 5e-6 is acceptable, 4e-6 is not
-        volts_per_div = self.round_up_lockstep(volts_per_div)
-        self.vbs_write('app.Acquisition.%s.VerScale = %0.0e' % (channel, volts_per_div))
-        self.vbs_write('app.Acquisition.%s.VerOffset = %0.0e' % (channel, volt_offset))
+        with self.batch():
+            # Lecroy only allows digits 1, 2, and 5.  e.g. 5e-6 is acceptable, 4e-6 is not
+            volts_per_div = self.round_up_lockstep(volts_per_div)
+            self.vbs_write('app.Acquisition.%s.VerScale = %0.0e' % (channel, volts_per_div))
+            self.vbs_write('app.Acquisition.%s.VerOffset = %0.0e' % (channel, volt_offset))
 
     def find_vertical_scale(self, channel = 'C1'):
         self.vbs_write('app.Acquisition.%s.FindScale' % channel)
 
 
     def set_horizontal_scale(self, time_per_div = 1e-6, time_offset = 0):
-        self.vbs_write('app.Acquisition.Horizontal.HorScale = %0.6e' % time_per_div)
-        self.vbs_write('app.Acquisition.Horizontal.HorOffset = %0.6e' % time_offset)
+        with self.batch():
+            self.vbs_write('app.Acquisition.Horizontal.HorScale = %0.6e' % time_per_div)
+            self.vbs_write('app.Acquisition.Horizontal.HorOffset = %0.6e' % time_offset)
 
     def set_memory_samples(self, num_samples = 1e6):
         self.vbs_write('app.Acquisition.Horizontal.MaxSamples = %0.3e' % num_samples)
@@ -117,9 +522,10 @@ class LeCroy620Zi(object):
 
     def set_trigger(self, source = 'C1', volt_level = 0.1, slope = 'positive'):
         """ Slope should be "Either" / "Negative" / "Positive" """
-        self.vbs_write('app.Acquisition.Trigger.Source = "%s"' % source)
-        self.vbs_write('app.Acquisition.Trigger.%s.Level = %0.4e' % (source, volt_level))
-        self.vbs_write('app.Acquisition.Trigger.%s.Slope = "%s"' % (source, slope))
+        with self.batch():
+            self.vbs_write('app.Acquisition.Trigger.Source = "%s"' % source)
+            self.vbs_write('app.Acquisition.Trigger.%s.Level = %0.4e' % (source, volt_level))
+            self.vbs_write('app.Acquisition.Trigger.%s.Slope = "%s"' % (source, slope))
 
     def set_trigger_mode(self, trigger_mode = 'Normal'):
         """ trigger_mode should be set to Auto/Normal/Single/Stop """
@@ -127,17 +533,19 @@ class LeCroy620Zi(object):
 
 
     def set_persistence(self, channel = 'C1', persistence = False, monochrome = False):
-        self.vbs_write('app.Display.LockPersistence = "PerTrace"')
-        self.vbs_write('app.Acquisition.%s.Persisted = %s' % (channel, persistence))
-        self.vbs_write('app.Acquisition.%s.PersistenceMonochrome = %s' % (channel, monochrome))
+        with self.batch():
+            self.vbs_write('app.Display.LockPersistence = "PerTrace"')
+            self.vbs_write('app.Acquisition.%s.Persisted = %s' % (channel, persistence))
+            self.vbs_write('app.Acquisition.%s.PersistenceMonochrome = %s' % (channel, monochrome))
 
 
     def label_channel(self, channel = 'C1', label = 'Channel 1 label text'):
-        if (label == '') or (label == False) or (label == None):
-            self.vbs_write('app.Acquisition.%s.ViewLabels = False' % channel)
-        else:
-            self.vbs_write('app.Acquisition.%s.LabelsText = "%s"' % (channel, label))
-            self.vbs_write('app.Acquisition.%s.ViewLabels = True' % channel)
+        with self.batch():
+            if (label == '') or (label == False) or (label == None):
+                self.vbs_write('app.Acquisition.%s.ViewLabels = False' % channel)
+            else:
+                self.vbs_write('app.Acquisition.%s.LabelsText = "%s"' % (channel, label))
+                self.vbs_write('app.Acquisition.%s.ViewLabels = True' % channel)
 
 
     def set_display_gridmode(self, gridmode = 'Auto'):
@@ -150,23 +558,25 @@ class LeCroy620Zi(object):
         """ Possible param_engine values listed in a table on page 1-151 of the automation manual.
         Some sample param_engine values are:
         Frequency / LevelAtX / Fall / Maximum / Mean / Median / Minimum / PeakToPeak """
-        self.vbs_write('app.Measure.ShowMeasure = %s' % show_table)
-        self.vbs_write('app.Measure.%s.ParamEngine = "%s"' % (parameter, param_engine))
-        if source1 is not None:
-            self.vbs_write('app.Measure.%s.Source1 = "%s"' % (parameter, source1))
-        if source2 is not None:
-            self.vbs_write('app.Measure.%s.Source2 = "%s"' % (parameter, source2))
-        self.vbs_write('app.Measure.%s.View = True' % parameter)
+        with self.batch():
+            self.vbs_write('app.Measure.ShowMeasure = %s' % show_table)
+            self.vbs_write('app.Measure.%s.ParamEngine = "%s"' % (parameter, param_engine))
+            if source1 is not None:
+                self.vbs_write('app.Measure.%s.Source1 = "%s"' % (parameter, source1))
+            if source2 is not None:
+                self.vbs_write('app.Measure.%s.Source2 = "%s"' % (parameter, source2))
+            self.vbs_write('app.Measure.%s.View = True' % parameter)
 
 
     def set_math(self, math_channel = 'F1', operator = 'AbsoluteValue', source1 = 'C1', source2 = None):
         """ Possible operator values listed in a table on page 1-151 of the automation manual.
         Sample values include: Average / Trend / Histogram / FFT / Integral / etc """
-        self.vbs_write('app.Math.%s.Operator1 = "%s"' % (math_channel, operator))
-        if source1 is not None:
-            self.vbs_write('app.Math.%s.Source1 = "%s"' % (math_channel, source1))
-        if source2 is not None:
-            self.vbs_write('app.Math.%s.Source1 = "%s"' % (math_channel, source2))
+        with self.batch():
+            self.vbs_write('app.Math.%s.Operator1 = "%s"' % (math_channel, operator))
+            if source1 is not None:
+                self.vbs_write('app.Math.%s.Source1 = "%s"' % (math_channel, source1))
+            if source2 is not None:
+                self.vbs_write('app.Math.%s.Source1 = "%s"' % (math_channel, source2))
 
 
     def get_parameter_value(self, parameter = 'P1'):
@@ -178,64 +588,117 @@ class LeCroy620Zi(object):
         return self.vbs_ask('app.Acquisition.TriggerMode')
 
 
-    def get_wf_data(self,channel='C1', out_of_range_as_nan = True):  # e.g. channel = C1 or F3 etc
-        self.write('WAIT;' + channel + ':WAVEFORM?') # Contains waveform data
-        databytes = self.read_raw()
-
-        # Trim and parse blocks of data
-        databytes = databytes[databytes.index(ord('#')) + 11:]
-        wavedesc_length = int(np.frombuffer(databytes[36:36+4], np.int32))
-        desc = databytes[:wavedesc_length] # 'WAVEDESC' block
-        databytes = databytes[wavedesc_length:]
-        if databytes[-1] == ord('\n'): databytes = databytes[:-1] # Strip trailing '\n'
-        data = np.frombuffer(databytes, np.int16)
-
-        # Mask invalid data
-        if out_of_range_as_nan == True:
-            y = np.array(data, dtype = np.float64)
-            y[data >= 32512] = np.nan # Not sure why this is 2**15 - 2**8 but that's the maximum number on the Lecroy Wavepro 7100
-            y[data == -32768] = np.nan
+    def _use_sample_width(self, sample_width):
+        if (sample_width is not None) and (sample_width.upper() != self.comm_format):
+            self.set_comm_format(sample_width)
+
+
+    def get_waveform(self, channel = 'C1', out_of_range_as_nan = True, sample_width = None):
+        """ Downloads a trace (e.g. channel = C1 or F3 etc) and returns it as a
+        LeCroyWaveform without copying or scaling the sample data.  sample_width
+        ('WORD' or 'BYTE') switches the transfer format first, if given """
+        with self.lock:
+            self._use_sample_width(sample_width)
+            self.write('WAIT;' + channel + ':WAVEFORM?') # Contains waveform data
+            databytes = self.read_raw()
+        return LeCroyWaveform(databytes, out_of_range_as_nan = out_of_range_as_nan)
+
+
+    def get_wf_data(self,channel='C1', out_of_range_as_nan = True, sample_width = None):  # e.g. channel = C1 or F3 etc
+        wf = self.get_waveform(channel = channel, out_of_range_as_nan = out_of_range_as_nan, sample_width = sample_width)
+        return wf.x, wf.y
+
+
+    def get_waveforms(self, channels = ['C1', 'C2', 'C3', 'C4'], out_of_range_as_nan = True, sample_width = None):
+        """ Downloads several traces by sending all of the WAVEFORM? queries in a
+        single message and parsing the concatenated reply in one pass.
+        Returns a list of LeCroyWaveforms in the same order as `channels` """
+        with self.lock:
+            self._use_sample_width(sample_width)
+            self.write('WAIT;' + ';'.join(ch + ':WAVEFORM?' for ch in channels))
+            databytes = self.read_raw()
+            waveforms = split_waveforms(databytes, out_of_range_as_nan = out_of_range_as_nan)
+            # Some interfaces terminate each block separately, so keep reading until all have arrived
+            while len(waveforms) < len(channels):
+                databytes = databytes + self.read_raw()
+                waveforms = split_waveforms(databytes, out_of_range_as_nan = out_of_range_as_nan)
+        return waveforms[:len(channels)]
+
+
+    def get_multiple_wf_data(self, channels = ['C1', 'C2', 'C3', 'C4'], out_of_range_as_nan = True, sample_width = None):
+        """ Batched version of get_wf_data for several channels.  Returns (x, Y) where
+        Y is a preallocated (channels x samples) array.  If all channels share a
+        timebase x is a single shared time axis, otherwise it is (channels x samples) """
+        waveforms = self.get_waveforms(channels = channels, out_of_range_as_nan = out_of_range_as_nan,
+                                       sample_width = sample_width)
+        num_points = len(waveforms[0])
+        if any(len(wf) != num_points for wf in waveforms):
+            raise ValueError('Channels %s have different record lengths, use get_waveforms() instead' % channels)
+        Y = np.empty((len(waveforms), num_points))
+        for i, wf in enumerate(waveforms):
+            wf.get_voltages(out = Y[i])
+        shared_timebase = all((wf.hinterval, wf.hoffset) == (waveforms[0].hinterval, waveforms[0].hoffset)
+                              for wf in waveforms)
+        if shared_timebase:
+            x = waveforms[0].get_times()
         else:
-            y = data
-
-        # Get offset/gain data
-        ADDR_VGAIN = 156
-        ADDR_VOFFSET = 160
-        ADDR_HINTERVAL = 176
-        ADDR_HOFFSET = 180
-        ADDR_PNTS_PER_SCREEN = 120#120
-        ADDR_WAVE_ARRAY_COUNT = 116 # "number of data points in the data array"
-        vgain = float(np.frombuffer(desc[ADDR_VGAIN:ADDR_VGAIN+4], np.float32))
-        voffset = float(np.frombuffer(desc[ADDR_VOFFSET:ADDR_VOFFSET+4], np.float32))
-        hinterval = float(np.frombuffer(desc[ADDR_HINTERVAL:ADDR_HINTERVAL+4], np.float32))
-        hoffset = float(np.frombuffer(desc[ADDR_HOFFSET:ADDR_HOFFSET+8], np.double))
-        num_datapoints_array = int(np.frombuffer(desc[ADDR_WAVE_ARRAY_COUNT:ADDR_WAVE_ARRAY_COUNT+4], np.int32))
-        num_points_scope = int(np.frombuffer(desc[ADDR_PNTS_PER_SCREEN:ADDR_PNTS_PER_SCREEN+4], np.int32))
-
-        # Compute actual vaules from offset/gain data and raw bytes
-        x = np.array(list(range(num_datapoints_array)))*hinterval + hoffset 
-        y = y*vgain - voffset
-
-        # Clip to # of points on scope, otherwise have array problems with scope returning e.g. 1,001 vs 1,002 points
-        x = x[:num_points_scope]
-        y = y[:num_points_scope]
+            x = np.empty((len(waveforms), num_points))
+            for i, wf in enumerate(waveforms):
+                wf.get_times(out = x[i])
+        return x, Y
+
 
-        return x,y
 
+    def arm_single(self):
+        """ Clears the internal state change register (INR) and arms the scope
+        for a single acquisition """
+        self.query('INR?') # Reading INR clears it
+        self.set_trigger_mode(trigger_mode = 'Single')
 
 
-    def get_single_trace(self, channel = 'C1'):
+    def wait_for_acquisition(self, timeout = None, max_wait_per_query = 10):
+        """ Blocks until an armed acquisition has completed, using the scope's own
+        WAIT command followed by *OPC? instead of polling the trigger mode over VBS.
+        Completion is confirmed by bit 0 ("new signal acquired") of INR?.
+        Returns True when a new acquisition is available, or False if `timeout`
+        seconds elapse first (timeout = None waits indefinitely) """
+        t_start = time.time()
+        while True:
+            if timeout is None:
+                wait_time = max_wait_per_query
+            else:
+                wait_time = min(timeout - (time.time() - t_start), max_wait_per_query)
+                if wait_time <= 0:
+                    return False
+            with self.lock:
+                visa_timeout = self.pyvisa.timeout
+                self.pyvisa.timeout = (wait_time + 5)*1e3 # Leave VISA some headroom past the WAIT
+                try:
+                    self.query('WAIT %0.3f;*OPC?' % wait_time)
+                finally:
+                    self.pyvisa.timeout = visa_timeout
+            if int(self.query('INR?')) & 1:
+                return True
+
+
+    async def wait_for_acquisition_async(self, timeout = None, max_wait_per_query = 10):
+        """ asyncio version of wait_for_acquisition(), which runs the blocking
+        WAIT in an executor thread so the event loop stays free """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.wait_for_acquisition, timeout, max_wait_per_query)
+
+
+    def get_single_trace(self, channel = 'C1', timeout = None):
         """ Sets scope to "single" trigger mode to acquire one trace, then waits until the trigger has happened
-        (indicated by the trigger mode changing to "Stopped").  Returns blank lists if no trigger occurs within 1 second """
-        n = 0; x = np.array([]); y = np.array([])
-        self.set_trigger_mode(trigger_mode = 'Single')
-        while self.get_trigger_mode() == 'Single' or n > 1e10:
-            time.sleep(1e-4)
-            n = n+1
+        using wait_for_acquisition().  Returns blank arrays if no trigger occurs within `timeout` seconds
+        (timeout = None waits indefinitely) """
+        self.arm_single()
+        if not self.wait_for_acquisition(timeout = timeout):
+            return np.array([]), np.array([])
         x,y = self.get_wf_data(channel=channel)
         return x,y
     
-    def get_multiple_traces(self, channels = ['C1', 'C2', 'C3', 'C4']):
+    def get_multiple_traces(self, channels = ['C1', 'C2', 'C3', 'C4'], timeout = None):
         """
         Added by Samuel Adler 4/2/2023
         
@@ -243,58 +706,113 @@ class LeCroy620Zi(object):
         ----------
         channels : TYPE, optional
             DESCRIPTION. The default is ['C1', 'C2', 'C3', 'C4'].
+        timeout : float, optional
+            Seconds to wait for a trigger.  The default of None waits indefinitely.
 
         Returns
         -------
         X : TYPE
             array of x aixs data for each channel.
         Y : TYPE
-            array of y axis data for each channel.
+            array of y axis data for each channel.  Empty if no trigger occurred.
         """
         X = np.empty(len(channels), dtype=object)
         Y = np.empty(len(channels), dtype=object)
-        n = 0
         for i in np.arange(len(channels)):
             X[i] = np.array([], dtype=float)
             Y[i] = np.array([], dtype=float)
-        self.set_trigger_mode(trigger_mode = 'Single')
-        while self.get_trigger_mode() == 'Single' or n > 1e10:
-            time.sleep(1e-4)
-            n = n+1
-        for i,channel in enumerate(channels):
-            X[i], Y[i] = self.get_wf_data(channel=channel)
+        self.arm_single()
+        if not self.wait_for_acquisition(timeout = timeout):
+            return X,Y
+        for i,wf in enumerate(self.get_waveforms(channels=channels)):
+            X[i], Y[i] = wf.x, wf.y
         return X,Y
 
 
+    def set_sequence_mode(self, num_segments = 1000, sequence = True):
+        """ Turns sequence (segmented memory) acquisition on or off.  In sequence
+        mode each arm of the trigger captures num_segments triggers back-to-back """
+        with self.batch():
+            if sequence is True:
+                self.vbs_write('app.Acquisition.Horizontal.NumSegments = %d' % num_segments)
+                self.vbs_write('app.Acquisition.Horizontal.SampleMode = "Sequence"')
+            else:
+                self.vbs_write('app.Acquisition.Horizontal.SampleMode = "RealTime"')
+
+
+    def get_sequence_traces(self, channel = 'C1', num_segments = None, timeout = None):
+        """ Arms the scope once for a sequence acquisition and downloads every
+        segment in a single WAVEFORM? transfer.  If num_segments is given the scope
+        is first put into sequence mode with that many segments.
+        Returns (x, Y, trigger_times) where x is the time axis of one segment, Y is a
+        (segments x samples) voltage array and trigger_times are the per-segment
+        trigger timestamps from the TRIGTIME array.  Returns empty arrays if no
+        acquisition completes within `timeout` seconds """
+        if num_segments is not None:
+            self.set_sequence_mode(num_segments = num_segments, sequence = True)
+        self.arm_single()
+        if not self.wait_for_acquisition(timeout = timeout):
+            return np.array([]), np.empty((0,0)), np.array([])
+        wf = self.get_waveform(channel = channel)
+        return wf.x, wf.get_segments(), wf.trigger_times
+
+
     # def get_math_data(self,channel='C1'):  # e.g. channel = C1 or F3 etc
         # return self.vbs_ask('app.Math.%s.Out.Result.Sweeps' % channel)
 
 
+    def benchmark_sample_width(self, channel = 'C1', num_samples_list = [1e6, 10e6], num_repeats = 5):
+        """ Times WAVEFORM? transfers of `channel` in WORD and BYTE format for each
+        memory depth in num_samples_list.  Returns a dictionary mapping each memory
+        depth to (word seconds, byte seconds, word/byte ratio) and prints a summary.
+        Note this changes the memory depth and leaves the scope in WORD format """
+        results = {}
+        for num_samples in num_samples_list:
+            self.set_memory_samples(num_samples = num_samples)
+            self.arm_single()
+            self.wait_for_acquisition(timeout = 10)
+            t = {}
+            for sample_width in ['WORD', 'BYTE']:
+                self.set_comm_format(sample_width)
+                self.get_waveform(channel = channel) # Warm-up
+                t_start = time.time()
+                for n in range(num_repeats):
+                    self.get_waveform(channel = channel)
+                t[sample_width] = (time.time() - t_start)/num_repeats
+            results[num_samples] = (t['WORD'], t['BYTE'], t['WORD']/t['BYTE'])
+            print('%0.0e samples: WORD %0.3f s, BYTE %0.3f s, ratio %0.2f' % ((num_samples,) + results[num_samples]))
+        self.set_comm_format('WORD')
+        return results
+
+
     def get_num_sweeps(self,channel='F1'):  # For use with histograms, trends, etc
         return int(self.vbs_ask('app.Math.%s.Out.Result.Sweeps' % channel))
 
     def setup_math_trend(self, math_channel = 'F1', source = 'P1', num_values = 10e3):
-        self.set_math(math_channel = math_channel, operator = 'Trend', source1 = source)
-        self.vbs_write('app.Math.%s.Operator1Setup.Values = %s' % (math_channel, num_values))
-        self.view_channel(channel = math_channel, view = True)
+        with self.batch():
+            self.set_math(math_channel = math_channel, operator = 'Trend', source1 = source)
+            self.vbs_write('app.Math.%s.Operator1Setup.Values = %s' % (math_channel, num_values))
+            self.view_channel(channel = math_channel, view = True)
 
 
     def setup_math_wf_average(self, math_channel = 'F1', source = 'C1', num_sweeps = 100):
-        self.set_math(math_channel = math_channel, operator = 'Average', source1 = source)
-        self.vbs_write('app.Math.%s.Operator1Setup.Sweeps = %s' % (math_channel, num_sweeps))
-        self.view_channel(channel = math_channel, view = True)
+        with self.batch():
+            self.set_math(math_channel = math_channel, operator = 'Average', source1 = source)
+            self.vbs_write('app.Math.%s.Operator1Setup.Sweeps = %s' % (math_channel, num_sweeps))
+            self.view_channel(channel = math_channel, view = True)
 
 
     def setup_math_histogram(self, math_channel = 'F1', source = 'P1', num_values = 10e3,
                             num_bins = 100, center = 0, width_per_div = 1, auto_scale = True):
-        self.set_math(math_channel = math_channel, operator = 'Histogram', source1 = source)
-        self.vbs_write('app.Math.%s.Operator1Setup.Values = %s' % (math_channel, num_values))
-        self.vbs_write('app.Math.%s.Operator1Setup.AutoFindScale = %s' % (math_channel, auto_scale))
-        self.vbs_write('app.Math.%s.Operator1Setup.Bins = %s' % (math_channel, num_bins))
-        self.vbs_write('app.Math.%s.Operator1Setup.Center = %s' % (math_channel, center))
-        width_per_div = self.round_up_lockstep(width_per_div)
-        self.vbs_write('app.Math.%s.Operator1Setup.HorScale = %s' % (math_channel, width_per_div))
-        self.view_channel(channel = math_channel, view = True)
+        with self.batch():
+            self.set_math(math_channel = math_channel, operator = 'Histogram', source1 = source)
+            self.vbs_write('app.Math.%s.Operator1Setup.Values = %s' % (math_channel, num_values))
+            self.vbs_write('app.Math.%s.Operator1Setup.AutoFindScale = %s' % (math_channel, auto_scale))
+            self.vbs_write('app.Math.%s.Operator1Setup.Bins = %s' % (math_channel, num_bins))
+            self.vbs_write('app.Math.%s.Operator1Setup.Center = %s' % (math_channel, center))
+            width_per_div = self.round_up_lockstep(width_per_div)
+            self.vbs_write('app.Math.%s.Operator1Setup.HorScale = %s' % (math_channel, width_per_div))
+            self.view_channel(channel = math_channel, view = True)
 
 
     def collect_sweeps(self, channel = 'F1', num_sweeps = 1000):
@@ -310,6 +828,36 @@ class LeCroy620Zi(object):
 
 
 
+    def collect_pulse_statistics(self, channel = 'C1', reference_channel = None, num_pulses = 10000,
+                                 num_segments = 1000, statistics = None, num_bins = 1000, timeout = None):
+        """ Accumulates pulse statistics on the host instead of in the scope's math
+        histograms, so the number of pulses is not limited by the trend buffer.
+        Pulses are captured num_segments at a time in sequence mode (one arm and one
+        transfer per batch), measured with pulse_parameters() and added to one
+        RunningStatistics per parameter.  Pass the returned `statistics` dictionary
+        back in to keep accumulating across calls """
+        if statistics is None:
+            statistics = {}
+        channels = [channel] if reference_channel is None else [channel, reference_channel]
+        self.set_sequence_mode(num_segments = num_segments, sequence = True)
+        num_collected = 0
+        while num_collected < num_pulses:
+            self.arm_single()
+            if not self.wait_for_acquisition(timeout = timeout):
+                break
+            waveforms = self.get_waveforms(channels = channels)
+            x = waveforms[0].x
+            Y_reference = waveforms[1].get_segments() if reference_channel is not None else None
+            params = pulse_parameters(x, waveforms[0].get_segments(), Y_reference = Y_reference)
+            for name, values in params.items():
+                if name not in statistics:
+                    statistics[name] = RunningStatistics(num_bins = num_bins)
+                statistics[name].update(values)
+            num_collected += waveforms[0].num_segments
+        return statistics
+
+
+
     def save_screenshot(self, file_path = None, white_background = True):
         if file_path == None:
             time_str = datetime.datetime.now().strftime('%Y-%m-%d %H-%M-%S')
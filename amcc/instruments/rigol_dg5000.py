@@ -1,31 +1,35 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
+from amcc.instruments.waveform_cache import get_waveform_cache, waveform_key
 import numpy as np
 import time
 
-class RigolDG5000(object):
-    """Python class for the Rigol DG5000 series arbitrary waveform
-    generators, written by Adam McCaughan"""
 
-    def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+# The DG5000 has a 14-bit DAC and accepts binary DAC16 data in packets of 16384 points
+DAC_BITS = 14
+DAC16_PACKET_POINTS = 16384
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
 
-    def query(self, string):
-        return self.pyvisa.query(string)
+def voltages_to_dac(voltages, num_bits = DAC_BITS):
+    """ Converts voltages on [-1.0, +1.0] to unsigned DAC codes (0 to 2**num_bits - 1)
+    in one vectorized step.  Out-of-range values are clipped.  Returns a
+    little-endian uint16 array """
+    voltages = np.clip(np.asarray(voltages, dtype = np.float64), -1, 1)
+    return np.round((voltages + 1)/2*(2**num_bits - 1)).astype('<u2')
+
 
-    def close(self):
-        self.pyvisa.close()
+class RigolDG5000(GenericInstrument):
+    """Python class for the Rigol DG5000 series arbitrary waveform
+    generators, written by Adam McCaughan"""
+
+    def __init__(self, visa_name):
+        super().__init__(visa_name)
+        # Remembers what is in each channel's volatile arb memory, so setting up
+        # the same arb again skips the upload
+        self.waveform_cache = get_waveform_cache(self)
 
     def reset(self):
         self.write('*RST')
+        self.waveform_cache.clear()
         
     def identify(self):
         return self.query('*IDN?')
@@ -162,8 +166,6 @@ class RigolDG5000(object):
         t = np.array(t);  v = np.array(v)
 
         v = v-min(v);  v = 2*v/max(v);  v = v-1
-        # Change timeout to 60 sec to allow writing of waveform
-        temp = self.pyvisa.timeout; self.pyvisa.timeout = 60e3
         t_interp = np.linspace(t[0],t[-1], num_pts) # Can be up to 512 kpts long
         v_interp = np.interp(t_interp, t, v)
 
@@ -171,10 +173,18 @@ class RigolDG5000(object):
         print(data_strings)
         #data_msg = ', '.join(data_strings)
         data_msg = str(data_strings) # Bryce
-        self.set_vpp(self.get_vpp(channel = channel), channel = channel) # Hack to select a channel
-        self.write('DATA VOLATILE, ' + data_msg) # Form of "DATA VOLATILE, 1, .67, .33, 0, -.33", p200 user's guide
-        self.write('DATA:POIN:INT LIN') # Set it to linearly interpolate between points
-        self.timeout = temp
+        with self.lock:
+            # Change timeout to 60 sec to allow writing of waveform
+            temp = self.pyvisa.timeout; self.pyvisa.timeout = 60e3
+            try:
+                self.set_vpp(self.get_vpp(channel = channel), channel = channel) # Hack to select a channel
+                key = waveform_key(data_msg.encode(), 'VOLT')
+                if not self.waveform_cache.lookup('VOLATILE%s' % channel, key):
+                    self.write('DATA VOLATILE, ' + data_msg) # Form of "DATA VOLATILE, 1, .67, .33, 0, -.33", p200 user's guide
+                    self.waveform_cache.store('VOLATILE%s' % channel, key, len(data_msg))
+                self.write('DATA:POIN:INT LIN') # Set it to linearly interpolate between points
+            finally:
+                self.pyvisa.timeout = temp
     
     def setup_arb_wf_raw(self, voltages = [-1.0, 0.0, 0.5, 0.5, 0.75, 1, 0], channel = 1, normalize = False):
 
@@ -183,32 +193,30 @@ class RigolDG5000(object):
             voltages = voltages - min(voltages)
             voltages = voltages/max(voltages)*2 -1
 
-        temp = self.pyvisa.timeout; self.pyvisa.timeout = 60e3
-
-        # data_strings = ['%0.3f' % x for x in v_interp]
-        # data_msg = ', '.join(data_strings)
-
-
-        #byte_list = []
-        #dac_voltage_list = []
-        dac_string = ''
-        for n, v in enumerate(voltages):
-            dac_voltage = int((v+1)/2*(2**14-1))
-            dac_string += str(dac_voltage) + ','
-        #    dac_voltage_list.append(dac_voltage)
-        #    new_datapoint = struct.pack('<H', dac_voltage)
-        #    byte_list.append(new_datapoint)
-        dac_string = dac_string[:-1]
+        if len(voltages) % DAC16_PACKET_POINTS == 0:
+            # Lengths of whole packets can go as binary
+            self.setup_arb_wf_raw_16k_increments(voltages, channel = channel)
+            self.write('DATA:POIN:INT OFF')
+            return
 
+        dac = voltages_to_dac(voltages)
         self.set_vpp(self.get_vpp(channel = channel), channel = channel) # Hack to select a channel
+        key = waveform_key(dac, 'DAC')
+        if self.waveform_cache.lookup('VOLATILE%s' % channel, key):
+            self.write('DATA:POIN:INT OFF')
+            return
 
-        self.write(':DATA:DAC VOLATILE,' + dac_string)
-
-
-        # self.write('DATA VOLATILE, ' + data_msg) # Form of "DATA VOLATILE, 1, .67, .33, 0, -.33", p200 user's guide
-        self.query('*OPC?')
-        self.write('DATA:POIN:INT OFF') # Set it to linearly interpolate between points
-        self.timeout = temp
+        dac_string = ','.join(dac.astype(str))
+        with self.lock:
+            temp = self.pyvisa.timeout; self.pyvisa.timeout = 60e3
+            try:
+                self.write(':DATA:DAC VOLATILE,' + dac_string)
+                # self.write('DATA VOLATILE, ' + data_msg) # Form of "DATA VOLATILE, 1, .67, .33, 0, -.33", p200 user's guide
+                self.query('*OPC?')
+                self.write('DATA:POIN:INT OFF') # Set it to linearly interpolate between points
+            finally:
+                self.pyvisa.timeout = temp
+        self.waveform_cache.store('VOLATILE%s' % channel, key, dac.nbytes)
 
 
 
@@ -224,28 +232,27 @@ class RigolDG5000(object):
         if len(voltages) % 16384 != 0:
             raise ValueError('Length of `voltages` array must be a multiple of 16384')
 
-        while len(voltages) > 0:
-            header_string = ':DATA:DAC16 VOLATILE,'
-            if len(voltages) > 16384:
-                header_string += 'CON,'
-                voltages_to_write = voltages[:16384]
-                voltages = voltages[16384:]
-            else:
-                header_string += 'END,'
-                voltages_to_write = voltages
-                voltages = []
-            
-            data_bytes = bytearray()
-            for v in voltages_to_write:
-                dac_voltage = int((v+1)/2*(2**14-1))
-                data_bytes += struct.pack('<H', dac_voltage)
-                
-            len_body_bytes = len(data_bytes)
-            num_digits_body_bytes = len(str(len_body_bytes))
-            hash_string = '#' + str(num_digits_body_bytes) + str(len_body_bytes)
-            
-            dac_bytes = header_string.encode() + hash_string.encode() + data_bytes + '\n'.encode()
-            self.pyvisa.write_raw(bytes(dac_bytes))
+        dac = voltages_to_dac(voltages)
+        key = waveform_key(dac, 'DAC')
+        if self.waveform_cache.lookup('VOLATILE%s' % channel, key):
+            return
+
+        # Every packet is the same size, so build one packet buffer and only
+        # overwrite its CON/END flag and data for each chunk
+        num_bytes = 2*DAC16_PACKET_POINTS
+        prefix = (':DATA:DAC16 VOLATILE,CON,#%i%i' % (len(str(num_bytes)), num_bytes)).encode()
+        flag_start = prefix.index(b'CON')
+        packet = bytearray(len(prefix) + num_bytes + 1)
+        packet[:len(prefix)] = prefix
+        packet[-1:] = b'\n'
+        packet_dac = np.frombuffer(packet, dtype = '<u2', count = DAC16_PACKET_POINTS, offset = len(prefix))
+        with self.lock:
+            for n in range(0, len(dac), DAC16_PACKET_POINTS):
+                is_last = (n + DAC16_PACKET_POINTS) >= len(dac)
+                packet[flag_start:flag_start+3] = b'END' if is_last else b'CON'
+                packet_dac[:] = dac[n:n+DAC16_PACKET_POINTS]
+                self.pyvisa.write_raw(bytes(packet))
+        self.waveform_cache.store('VOLATILE%s' % channel, key, dac.nbytes)
 
         # self.write('FUNC USER') # Output the selected waveform
 
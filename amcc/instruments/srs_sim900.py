@@ -0,0 +1,113 @@
+from amcc.instruments.generic_instrument import GenericInstrument
+import time
+
+
+def _parse_getn(reply):
+    """ Strips the definite-length block header from a GETN? reply, e.g.
+    '#3008+1.2345\r\n' -> '+1.2345\r\n' """
+    reply = reply.lstrip()
+    if not reply.startswith('#'):
+        return reply
+    num_digits = int(reply[1])
+    length = int(reply[2:2+num_digits])
+    return reply[2+num_digits:2+num_digits+length]
+
+
+class SIM900Mainframe(GenericInstrument):
+    """Python class for the SRS SIM900 mainframe.  Owns the (pooled) VISA
+    session to the mainframe and talks to the modules in its ports with
+    SNDT / GETN?, holding the session lock so that modules in different ports
+    never interleave their messages.  Modules attach to it as lightweight
+    port handles, e.g.
+
+        sim900 = SIM900Mainframe('GPIB0::2')
+        thermometer = SIM922(sim900, sim900port = 1)
+        dmm = SIM970(sim900, sim900port = 7)
+    """
+    def __init__(self, visa_name):
+        super().__init__(visa_name)
+        # Configure the termination characters
+        self.write('CEOI ON')
+        self.write('EOIX ON')
+
+    def port_write(self, port, message):
+        self.write('SNDT %d,"%s"' % (port, message)) # Format of 'SNDT 4,"GAIN 10"'
+
+    def port_read(self, port, max_bytes = 128):
+        """ Returns whatever is waiting in the output buffer of `port` """
+        return _parse_getn(self.query('GETN? %d,%d' % (port, max_bytes)))
+
+    def _read_lines(self, port, num_lines, timeout, poll_interval = 0.005):
+        """ Keeps reading `port` until num_lines complete replies have arrived,
+        waiting poll_interval between empty reads so the GPIB bus isn't flooded
+        with GETN? while the module is busy """
+        data = ''
+        t_start = time.time()
+        while data.count('\n') < num_lines:
+            new_data = self.port_read(port)
+            if not new_data:
+                time.sleep(poll_interval)
+            data += new_data
+            if (time.time() - t_start) > timeout:
+                raise TimeoutError('SIM900 port %d did not reply within %s s' % (port, timeout))
+        return [line.strip() for line in data.strip().split('\n')][:num_lines]
+
+    def port_query(self, port, message, timeout = 5):
+        with self.lock:
+            self.port_write(port, message)
+            return self._read_lines(port, 1, timeout)[0]
+
+    def query_ports(self, queries, timeout = 5):
+        """ Batched read across several ports.  `queries` is a list of
+        (port, message) pairs, e.g. [(1, 'TVAL? 1'), (1, 'TVAL? 2'), (7, 'VOLT? 1')].
+        All of the queries are sent to the modules in a single compound SNDT
+        message so they are answered in parallel, then each port's replies are
+        collected with GETN?.  Returns the replies in the same order as `queries` """
+        ports = []
+        for port, message in queries:
+            if port not in ports: ports.append(port)
+        with self.lock:
+            self.write(';'.join('SNDT %d,"%s"' % (port, message) for port, message in queries))
+            replies = {}
+            for port in ports:
+                num_lines = sum(1 for p, m in queries if p == port)
+                replies[port] = self._read_lines(port, num_lines, timeout)
+        return [replies[port].pop(0) for port, message in queries]
+
+
+class SIM900Module(GenericInstrument):
+    """Base class for the SRS modules that sit inside a SIM900 mainframe.  Either
+    pass in a SIM900Mainframe to share, or a VISA name in which case a mainframe
+    handle is created (and pooled) for this module"""
+    def __init__(self, visa_name, sim900port):
+        if isinstance(visa_name, SIM900Mainframe):
+            self.mainframe = visa_name
+            self._owns_mainframe = False
+        else:
+            self.mainframe = SIM900Mainframe(visa_name)
+            self._owns_mainframe = True
+        self.rm = self.mainframe.rm
+        self.visa_name = self.mainframe.visa_name
+        self.pyvisa = self.mainframe.pyvisa
+        self.lock = self.mainframe.lock
+        self.sim900port = sim900port
+
+    def close(self):
+        if self._owns_mainframe:
+            self.mainframe.close()
+        self.pyvisa = None
+
+    def write_simport(self, message):
+        self.mainframe.port_write(self.sim900port, message)
+
+    def read_simport(self):
+        return self.mainframe.port_read(self.sim900port)
+
+    def query_simport(self, message):
+        return self.mainframe.port_query(self.sim900port, message)
+
+    def reset(self):
+        self.write_simport('*RST')
+
+    def identify(self):
+        return self.query_simport('*IDN?')
@@ -1,75 +1,10 @@
-import pyvisa as visa
+from amcc.instruments.srs_sim900 import SIM900Module
 import numpy as np
 
-class SIM921(object):
+class SIM921(SIM900Module):
     """Python class for SRS SIM921 AC resistance bridge inside a SIM900
-    mainframe, written by Adam McCaughan"""
-    def __init__(self, visa_name, sim900port):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-        self.sim900port = sim900port
-        # Anything else here that needs to happen on initialization
-        # Configure the termination characters
-        self.write('CEOI ON')
-        self.write('EOIX ON')
-
-
-    def read(self):
-        return self.pyvisa.read()
-
-
-    def write(self, string):
-        self.pyvisa.write(string)
-
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-
-    def reset(self):
-        self.write_simport('*RST')
-
-
-    def close(self):
-        return self.pyvisa.close()
-
-
-    # def write_simport(self, message):
-    #     write_str = 'SNDT ' + str(self.sim900port) + ',\"' + message + '\"'
-    #     # print write_str
-    #     self.write(write_str) # Format of 'SNDT 4,\"GAIN 10\"'
-
-
-    # def read_simport(self):
-    #     self.query('GETN? %s' % self.sim900port)
-
-    def write_simport(self, message):
-        self.write('CONN %d,"xyz"' % self.sim900port)
-        self.write(message)
-        self.write('xyz')
-
-
-    def read_simport(self):
-        self.write('CONN %d,"xyz"' % self.sim900port)
-        data = self.read()
-        self.write('xyz')
-        return data
-
-    # def ask_simport(self, message):
-    #     write_str = 'SNDT ' + str(self.sim900port) + ',\"' + message + '\"'
-    #     self.write_simport(write_str)
-    #     return self.query(write_str) # Format of 'SNDT 4,\"GAIN 10\"'
-
-    def query_simport(self, message):
-        self.write('CONN %d,"xyz"' % self.sim900port)
-        reply = self.query(message)
-        self.write('xyz')
-        return reply
-
-    def identify(self):
-        return self.query_simport('*IDN?')
+    mainframe, written by Adam McCaughan.  visa_name can also be a shared
+    SIM900Mainframe"""
 
     def read_resistance(self):
         R = float(self.query_simport('RVAL?'))
@@ -1,29 +1,30 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 import time
 
-class Switchino(object):
+class Switchino(GenericInstrument):
     """Python class for a single-pull 10-throw switch,
     written by Adam McCaughan"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
+        super().__init__(visa_name)
+        self.set_session_attributes(query_delay = 1) # Set extra delay time between write and read commands
 
     def read(self):
-        return self.pyvisa.read()
+        with self.lock:
+            return self.pyvisa.read()
         time.sleep(1)
         
     def write(self, string):
-        self.pyvisa.write(string)
+        with self.lock:
+            self.pyvisa.write(string)
         time.sleep(1)
     
     def query(self, string):
-        return self.pyvisa.query(string)
+        with self.lock:
+            return self.pyvisa.query(string)
         time.sleep(1)
     
     def close(self):
-        self.pyvisa.close()
+        super().close()
         time.sleep(1)
         
     def identify(self):
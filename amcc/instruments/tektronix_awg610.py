@@ -1,30 +1,23 @@
-import pyvisa as visa
-import struct
+from amcc.instruments.generic_instrument import GenericInstrument
+from amcc.instruments.tektronix_wfm import pad_sample_length, validate_voltages, encode_wfm
+from amcc.instruments.waveform_cache import get_waveform_cache, waveform_key
+import re
 import numpy as np
 
-class TektronixAWG610(object):
+class TektronixAWG610(GenericInstrument):
     """Python class for the Tektronix AWG610 Arbitrary Waveform Generator
     written by Adam McCaughan"""
+    max_sequence_lines = 8000 # Longest .seq file the AWG accepts
+
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.write_termination = '\n'
-        self.pyvisa.read_termination = '\n'
-        self.pyvisa.timeout = 5000
+        super().__init__(visa_name)
+        self.set_session_attributes(write_termination = '\n', read_termination = '\n')
+        # Skips re-uploading .wfm files the AWG already holds, see create_waveform()
+        self.waveform_cache = get_waveform_cache(self, list_function = self.list_file_sizes,
+                                                 delete_function = self.delete_file,
+                                                 case_sensitive = False)
         self.fg_mode = False # Otherwise in 'AWG' mode
 
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
-
     def identify(self):
         return self.query('*IDN?')
 
@@ -90,66 +83,30 @@ class TektronixAWG610(object):
     def create_waveform(self, voltages = np.linspace(-1,1,1000), filename = 'temp.wfm', clock = None,
                         marker1_data = None, marker2_data = None, auto_fix_sample_length = False,
                         normalize_voltages = False):
+        voltages = np.asarray(voltages, dtype = np.float64)
         if marker1_data is None:
-            marker1_data = [0]*len(voltages)
+            marker1_data = np.zeros(len(voltages), dtype = np.uint8)
         if marker2_data is None:
-            marker2_data = [0]*len(voltages)
+            marker2_data = np.zeros(len(voltages), dtype = np.uint8)
+        marker1_data = np.asarray(marker1_data, dtype = np.uint8)
+        marker2_data = np.asarray(marker2_data, dtype = np.uint8)
         if auto_fix_sample_length:
-            if len(voltages) < 512: voltages += [voltages[0]]*(512-len(voltages))
-            if (len(voltages) % 8) != 0: voltages += [voltages[0]]*(8-(len(voltages) % 8))
-            if len(marker1_data) < 512: marker1_data += [marker1_data[0]]*(512-len(marker1_data))
-            if (len(marker1_data) % 8) != 0: marker1_data += [marker1_data[0]]*(8-(len(marker1_data) % 8))
-            if len(marker2_data) < 512: marker2_data += [marker2_data[0]]*(512-len(marker2_data))
-            if (len(marker2_data) % 8) != 0: marker2_data += [marker2_data[0]]*(8-(len(marker2_data) % 8))
-                
-        
-        if (len(voltages) < 512) or (len(voltages) % 8 != 0):
-            raise ValueError('Length of `voltages` array must be >=512 elements and divisible by 8')
-        if (max(voltages) > 1) or (min(voltages) < -1):
-            raise ValueError('Values of `voltages` array must be on [-1.0,+1.0] interval')
-            
+            voltages = pad_sample_length(voltages)
+            marker1_data = pad_sample_length(marker1_data)
+            marker2_data = pad_sample_length(marker2_data)
+
         if normalize_voltages:
-            voltages = np.array(voltages)
-            voltages = voltages - min(voltages)
-            voltages = voltages/max(voltages)*2 -1
-
-
-        byte_list = []
-        marker_data = (np.array(marker1_data) + 2*np.array(marker2_data)).astype('uint16')
-        for n, v in enumerate(voltages):
-            new_datapoint = struct.pack('<f',v)
-            new_marker_data = struct.pack('<B',marker_data[n])
-            # if marker_data is None:
-            #     new_marker_data = b'\x00'
-            # else:
-            #     if marker_data[n] == False:
-            #         new_marker_data = b'\x00'
-            #     else:
-            #         new_marker_data = b'\x01'
-            # if n < 256: # Use marker 2 as a sync signal
-            #     new_marker_data = bytes([new_marker_data[0] + 2])
-            byte_list.append(new_datapoint)
-            byte_list.append(new_marker_data)
-        data_bytes = b''.join(byte_list)
+            voltages = voltages - voltages.min()
+            voltages = voltages/voltages.max()*2 - 1
+        validate_voltages(voltages)
 
-        # Forming header string for the SCPI command
-        header_string = 'MAGIC 1000\r\n'
-        # Forming trailer string for the SCPI command
-        if clock is not None:
-            trailer_string = 'CLOCK %0.3e\r\n' % clock
-        else:
-            trailer_string = '\r\n'
-        # Determining number of bytes in the data as well as digits in that
-        # number to set-up hash statement
-        len_body_bytes = len(data_bytes)
-        num_digits_body_bytes = len(str(len_body_bytes))
-        hash_string = '#' + str(num_digits_body_bytes) + str(len_body_bytes)
-        # # Concatenating the data into a single string
-        # byte_string = b''.join(data_bytes)
-        # Combining the header, trailer, hash statement, and data
-        data_bytes = header_string.encode() + hash_string.encode() + data_bytes + trailer_string.encode()
-        # Returning the result
+        marker_data = marker1_data + 2*marker2_data
+        data_bytes = encode_wfm(voltages, marker_data, clock = clock)
+        key = waveform_key(data_bytes)
+        if self.waveform_cache.lookup(filename, key):
+            return # The AWG already has this exact file
         self.write_data_to_file(data = data_bytes, filename = filename)
+        self.waveform_cache.store(filename, key, len(data_bytes))
         
         
     def create_pulse(self, filename, width, edge_width, voltage):
@@ -161,12 +118,8 @@ class TektronixAWG610(object):
         total_time = edge_width*2+width
         num_pts = int(total_time*samples_per_s) + 1
         t_interp = np.linspace(t[0],t[-1], num_pts) # Can be up to 512 kpts long
-        v_interp = np.interp(t_interp, t, v).tolist()
-        
-        if len(v_interp) < 512:
-            v_interp += [0]*(512-len(v_interp))
-        if (len(v_interp) % 8) != 0:
-            v_interp += [0]*(8-(len(v_interp) % 8))
+        v_interp = np.interp(t_interp, t, v)
+        v_interp = pad_sample_length(v_interp, pad_value = 0)
         self.create_waveform(voltages = v_interp, filename = filename)
 
 
@@ -182,10 +135,30 @@ class TektronixAWG610(object):
             pass
         else:
             raise ValueError('write_string_to_file() Argument `data` must be type str or bytes')
-        data_to_write = header_str.encode() + data + term_str.encode()
-        self.pyvisa.write_raw(data_to_write)
+        data_to_write = b''.join([header_str.encode(), data, term_str.encode()])
+        self.waveform_cache.forget(filename) # Overwritten, create_waveform() re-stores it
+        with self.lock:
+            self.pyvisa.write_raw(data_to_write)
     
     
+    def list_file_sizes(self):
+        """ Returns a dict of the (upper case) names of the files in the current
+        directory of the AWG and their sizes in bytes """
+        # Reply is like '<used>,<free>,"TEMP.WFM,,1234","TEMP.SEQ,,567"'
+        files = re.findall(r'"([^",]+),[^",]*,(\d+)"', self.query('MMEMORY:CATALOG?'))
+        return {name.upper() : int(size) for name, size in files}
+
+
+    def list_files(self):
+        """ Returns the (upper case) names of the files in the current directory of the AWG """
+        return list(self.list_file_sizes())
+
+
+    def delete_file(self, filename = 'temp.wfm'):
+        self.write('MMEMORY:DELETE "%s"' % filename)
+        self.waveform_cache.forget(filename)
+
+
     def read_file(self, filename = 'temp.wfm'):        
         self.write('MMEMORY:DATA? "%s"' % filename)
         hash_symbol = self.pyvisa.read_bytes(count = 1)
@@ -225,6 +198,12 @@ class TektronixAWG610(object):
             raise ValueError('Lowpass filter freq must be in %s' % valid_freqs)
         
         
+    def upload_sequence(self, sequence, filename = 'temp.seq'):
+        """ Uploads a SequenceBuilder (see tektronix_sequence) as `filename` plus
+        the waveform files it needs """
+        return sequence.upload(self, filename = filename)
+
+
     def create_sequence(self, filename = 'temp.seq', wfm_filenames = ['temp.wfm', 'temp2.wfm'], wfm_filenames_ch2 = None,
                         wfm_repeats = None, wfm_trigger_wait = None):
         
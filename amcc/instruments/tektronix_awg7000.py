@@ -1,30 +1,37 @@
-import pyvisa as visa
-import array
-import struct
+from amcc.instruments.generic_instrument import GenericInstrument
+from amcc.instruments.waveform_cache import get_waveform_cache, waveform_key
+import hashlib
 import numpy as np
 
 
-class TektronixAWG7000(object):
+def encode_int_words(voltages, marker1_data = None, marker2_data = None, num_bits = 8):
+    """ Converts voltages on [-1.0, +1.0] (and 0/1 marker data) into the 16-bit
+    words of the AWG7000 integer waveform format: data in bits 0-13, left
+    aligned to `num_bits` of DAC resolution, marker 1 in bit 14 and marker 2 in
+    bit 15 (page 2-23 of the Tektronix 7000 Programmer Manual) """
+    voltages = np.asarray(voltages, dtype = np.float64)
+    words = ((voltages + 1)/2*(2**num_bits - 1)).astype('<u2') # Convert to num_bits number
+    words <<= (14 - num_bits) # Shift up to bit 13
+    if marker1_data is not None:
+        words |= (np.asarray(marker1_data) != 0).astype('<u2') << 14
+    if marker2_data is not None:
+        words |= (np.asarray(marker2_data) != 0).astype('<u2') << 15
+    return words
+
+
+class TektronixAWG7000(GenericInstrument):
     """Python class for the Tektronix AWG610 Arbitrary Waveform Generator
     written by Adam McCaughan"""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.write_termination = '\n'
-        self.pyvisa.read_termination = '\n'
-        self.pyvisa.timeout = 5000
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
-
-    def close(self):
-        self.pyvisa.close()
+        super().__init__(visa_name)
+        self.set_session_attributes(write_termination = '\n', read_termination = '\n')
+        # Skips re-uploading waveforms the AWG already holds, see create_waveform().
+        # Waveform memory is 32.4M points of 2 bytes (set max_bytes higher with
+        # the memory extension option)
+        self.waveform_cache = get_waveform_cache(self, max_bytes = 2*32.4e6,
+                                                 list_function = self.list_waveform_sizes,
+                                                 delete_function = self.delete_waveform,
+                                                 in_use_function = self.waveforms_in_use)
 
     def identify(self):
         return self.query('*IDN?')
@@ -42,25 +49,71 @@ class TektronixAWG7000(object):
     def _new_waveform(self, filename = 'temp', num_points = 1000):
         self.write('WLIST:WAVEFORM:NEW "{}", {:d}, INT'.format(filename, num_points))
 
-    def create_waveform(self, filename = 'temp.wfm', voltages = np.linspace(-1,1,1000), 
-                        marker1_data = None, marker2_data = None):
-        # NOTE: Currently only works when running on 8-bit DAC mode
-        num_pts = len(voltages)
-        self._new_waveform(filename = filename, num_points = num_pts)
-
-        # Process described on page 2-23 of Tektronix 7000 Programmer Manual
-        if marker1_data is None:
-            marker1_data = [0]*num_pts
-        if marker2_data is None:
-            marker2_data = [0]*num_pts
-        wfm_data = np.array((np.array(voltages)+1)/2*(2**8-1)).astype('uint16') # Convert to 8-bit number
-        wfm_data = wfm_data << 6 # Shift up 6 bits
-        marker_data = (np.array(marker1_data) + 2*np.array(marker2_data)).astype('uint16')
-        marker_data = marker_data << 14
-        data = wfm_data + marker_data
-        if len(voltages) > 650000000: raise ValueError('voltages must be shorter than 650,000,000')
-        header_string = f'WLIST:WAVEFORM:DATA "{filename}",'
-        self.pyvisa.write_binary_values(header_string, data, datatype='H', is_big_endian=False)
+    def _word_chunks(self, voltages, marker1_data, marker2_data, chunk_size, num_bits):
+        """ Yields (start index, encoded words) for each chunk of the waveform.
+        voltages can be anything sliceable (numpy array, memmap, list) or an
+        iterator yielding arrays of voltages or (voltages, marker1, marker2) """
+        if hasattr(voltages, '__getitem__') and hasattr(voltages, '__len__'):
+            for start in range(0, len(voltages), chunk_size):
+                stop = start + chunk_size
+                yield start, encode_int_words(voltages[start:stop],
+                    None if marker1_data is None else marker1_data[start:stop],
+                    None if marker2_data is None else marker2_data[start:stop], num_bits)
+        else:
+            start = 0
+            for chunk in voltages:
+                if isinstance(chunk, tuple):
+                    words = encode_int_words(*chunk, num_bits = num_bits)
+                else:
+                    words = encode_int_words(chunk, num_bits = num_bits)
+                # Split up chunks larger than chunk_size
+                for n in range(0, len(words), chunk_size):
+                    yield start + n, words[n:n+chunk_size]
+                start += len(words)
+
+    def create_waveform(self, filename = 'temp.wfm', voltages = np.linspace(-1,1,1000),
+                        marker1_data = None, marker2_data = None, num_points = None,
+                        chunk_size = 2**20, num_bits = 8):
+        """ Streams a waveform into the waveform list in chunks of chunk_size
+        points using WLIST:WAVEFORM:DATA with a start index and size, so host
+        memory use stays bounded no matter how long the waveform is.  voltages
+        (on [-1.0, +1.0]) can be a numpy array, a np.memmap, or an iterator
+        yielding chunks (arrays of voltages, or (voltages, marker1, marker2)
+        tuples), in which case num_points must be given.  num_bits is the DAC
+        resolution the data is quantized to (default 8-bit mode) """
+        if num_points is None:
+            if not hasattr(voltages, '__len__'):
+                raise ValueError('num_points must be given when voltages is an iterator')
+            num_points = len(voltages)
+        if num_points > 650000000: raise ValueError('voltages must be shorter than 650,000,000')
+        is_array = hasattr(voltages, '__getitem__') and hasattr(voltages, '__len__')
+
+        if is_array:
+            # Hashing needs a pass through the data, but is much cheaper than uploading it
+            h = hashlib.sha1()
+            for start, words in self._word_chunks(voltages, marker1_data, marker2_data, chunk_size, num_bits):
+                h.update(words)
+            h.update(repr(()).encode()) # Same key as waveform_key() on the whole array
+            key = h.hexdigest()
+            if self.waveform_cache.lookup(filename, key):
+                return # The AWG already has this exact waveform
+        if filename in self.waveform_cache.entries:
+            self.delete_waveform(filename) # Stale copy, may have a different length
+        self.waveform_cache.make_room(filename, 2*num_points)
+        self._new_waveform(filename = filename, num_points = num_points)
+
+        num_written = 0
+        for start, words in self._word_chunks(voltages, marker1_data, marker2_data, chunk_size, num_bits):
+            num_bytes = words.nbytes
+            header = 'WLIST:WAVEFORM:DATA "%s",%i,%i,#%i%i' % (filename, start, len(words),
+                                                              len(str(num_bytes)), num_bytes)
+            with self.lock:
+                self.pyvisa.write_raw(b''.join([header.encode(), words.tobytes(), b'\n']))
+            num_written += len(words)
+        if num_written != num_points:
+            raise ValueError('Wrote %i points to a waveform of num_points = %i' % (num_written, num_points))
+        if is_array:
+            self.waveform_cache.store(filename, key, 2*num_points)
 
     # def create_marker(self,  marker1_data = [0,1,1,0], marker2_data = [1,1,1,0], filename = 'temp.mkr'):
     #     self._new_waveform(filename = filename, num_points = len(marker1_data))
@@ -96,6 +149,34 @@ class TektronixAWG7000(object):
     def load_waveform(self, filename = 'temp.wfm', channel = 1):
         self.write(f'SOUR{channel}:WAV "{filename}"')
 
+    def list_waveforms(self):
+        """ Returns the names of the waveforms in the waveform list """
+        num_waveforms = int(self.query('WLIST:SIZE?'))
+        return [self.query('WLIST:NAME? %i' % n).strip().strip('"') for n in range(num_waveforms)]
+
+    def list_waveform_sizes(self):
+        """ Returns a dict of the waveform list names and their sizes in bytes
+        (2 bytes per point) """
+        return {name : 2*int(self.query('WLIST:WAVEFORM:LENGTH? "%s"' % name))
+                for name in self.list_waveforms()}
+
+    def waveforms_in_use(self, channels = [1]):
+        """ Returns the names of the waveforms loaded on the channels or used
+        by the sequence, which must not be deleted """
+        names = set()
+        for channel in channels:
+            names.add(self.query('SOUR%i:WAV?' % channel).strip().strip('"'))
+        num_elements = int(self.query('SEQ:LENG?'))
+        for n in range(1, num_elements + 1):
+            for channel in channels:
+                names.add(self.query('SEQ:ELEM%i:WAV%i?' % (n, channel)).strip().strip('"'))
+        names.discard('')
+        return names
+
+    def delete_waveform(self, filename = 'temp.wfm'):
+        self.write(f'WLIST:WAVEFORM:DELETE "{filename}"')
+        self.waveform_cache.forget(filename)
+
     # def load_marker(self, filename = 'temp.mkr', channel = 1):
     #     self.instObj.write_binary_values('WLIST:WAVEFORM:MARKer:DATA "{}",'.format(wfName),data, datatype='B')    ### limited to 650,000,000 bytes of data
         
@@ -0,0 +1,183 @@
+from amcc.instruments.tektronix_wfm import validate_voltages, encode_wfm
+from amcc.instruments.waveform_cache import waveform_key
+from collections import OrderedDict
+import numpy as np
+
+
+# Largest repeat count of a single line of a .seq file (0 means repeat forever)
+MAX_REPEATS = 65536
+# Largest number of lines in a .seq file on the AWG610 (drivers can override it
+# with a max_sequence_lines attribute)
+MAX_LINES = 8000
+# add_loop() bodies are concatenated into a single waveform when that takes
+# at most this many samples
+MAX_LOOP_SAMPLES = 65536
+
+
+def _divisors(n):
+    small = [d for d in range(1, int(np.sqrt(n)) + 1) if n % d == 0]
+    return sorted(set(small + [n//d for d in small]))
+
+
+def find_period(voltages, markers, min_length = 512, multiple = 8):
+    """ Returns the shortest period (>= min_length samples and a multiple of
+    `multiple`) such that voltages and markers are that block repeated, or
+    len(voltages) if there is none """
+    n = len(voltages)
+    for period in _divisors(n):
+        if (period < min_length) or (period % multiple != 0) or (period == n):
+            continue
+        # Cheap check of the second block before comparing everything
+        if not (np.array_equal(voltages[period:2*period], voltages[:period]) and
+                np.array_equal(markers[period:2*period], markers[:period])):
+            continue
+        if (np.all(voltages.reshape(-1, period) == voltages[:period]) and
+                np.all(markers.reshape(-1, period) == markers[:period])):
+            return period
+    return n
+
+
+class SequenceBuilder(object):
+    """ Compiles a pulse program for the Tektronix AWG610 / AWG7101 into a .seq
+    file plus the smallest set of .wfm files needed to play it, e.g.
+
+        seq = SequenceBuilder()
+        seq.add_segment(pulse, marker1_data = sync)
+        seq.add_segment(np.zeros(1024), repeats = 1000) # Dead time
+        train = SequenceBuilder()
+        train.add_segment(pulse).add_segment(np.zeros(2048))
+        seq.add_loop(train, repeats = 50)
+        seq.add_segment(np.zeros(512), wait_for_trigger = True)
+        awg.upload_sequence(seq, filename = 'pulses.seq')
+
+    Identical segments are stored as a single waveform file, segments that are
+    a block repeated several times are reduced to that block with a repeat
+    count (if compress = True), and consecutive lines playing the same waveform
+    are merged into one line """
+
+    def __init__(self, prefix = 'seg', clock = None, compress = True, max_lines = MAX_LINES):
+        self.prefix = prefix
+        self.clock = clock
+        self.compress = compress
+        self.max_lines = max_lines
+        self.waveforms = OrderedDict() # Maps content key -> (voltages, markers)
+        self.lines = [] # List of [content key, repeats, wait_for_trigger]
+
+    def _add_line(self, key, repeats, wait_for_trigger):
+        if self.lines:
+            last = self.lines[-1]
+            if (last[0] == key) and (not wait_for_trigger) and (last[1] != 0) and (repeats != 0):
+                last[1] += repeats
+                return
+        self.lines.append([key, repeats, wait_for_trigger])
+
+    def add_segment(self, voltages, repeats = 1, wait_for_trigger = False,
+                    marker1_data = None, marker2_data = None):
+        """ Appends a segment of samples (on [-1.0, +1.0], >= 512 samples and a
+        multiple of 8) played `repeats` times (0 repeats forever).  If
+        wait_for_trigger is True the AWG waits for a trigger before playing it """
+        voltages = np.ascontiguousarray(voltages, dtype = np.float32)
+        validate_voltages(voltages)
+        markers = np.zeros(len(voltages), dtype = np.uint8)
+        if marker1_data is not None: markers += np.asarray(marker1_data, dtype = np.uint8)
+        if marker2_data is not None: markers += 2*np.asarray(marker2_data, dtype = np.uint8)
+        return self._add_waveform(voltages, markers, repeats, wait_for_trigger)
+
+    def _add_waveform(self, voltages, markers, repeats, wait_for_trigger):
+        if self.compress and repeats != 0:
+            period = find_period(voltages, markers)
+            repeats *= len(voltages)//period
+            voltages, markers = voltages[:period], markers[:period]
+        key = waveform_key(voltages, waveform_key(markers))
+        if key not in self.waveforms:
+            self.waveforms[key] = (voltages, markers)
+        self._add_line(key, int(repeats), bool(wait_for_trigger))
+        return self
+
+    def add_loop(self, body, repeats = 2):
+        """ Appends another SequenceBuilder played `repeats` times.  A body of a
+        single line just has its repeat count multiplied.  A short body (at
+        most MAX_LOOP_SAMPLES samples once its line repeats are played out, and
+        no waits or forever-repeats) is concatenated into one waveform,
+        deduplicated like any other segment, so the loop costs one line.
+        Other bodies keep their repeat counts and are unrolled into lines,
+        raising a ValueError if that would go over max_lines """
+        num_samples = sum(len(body.waveforms[key][0])*line_repeats
+                          for key, line_repeats, wait_for_trigger in body.lines)
+        concatenate = (len(body.lines) > 1) and (num_samples <= MAX_LOOP_SAMPLES) and all(
+            (line_repeats != 0) and not wait_for_trigger for key, line_repeats, wait_for_trigger in body.lines)
+        if concatenate:
+            voltages = np.concatenate([np.tile(body.waveforms[key][0], r) for key, r, w in body.lines])
+            markers = np.concatenate([np.tile(body.waveforms[key][1], r) for key, r, w in body.lines])
+            return self._add_waveform(voltages, markers, repeats, False)
+        for key, waveform in body.waveforms.items():
+            if key not in self.waveforms:
+                self.waveforms[key] = waveform
+        if len(body.lines) == 1 and not body.lines[0][2]:
+            key, line_repeats, wait_for_trigger = body.lines[0]
+            self._add_line(key, line_repeats*repeats, wait_for_trigger)
+            return self
+        num_lines = len(self.compile(max_lines = np.inf)[0])
+        num_body_lines = len(body.compile(max_lines = np.inf)[0])
+        if num_lines + num_body_lines*repeats > self.max_lines:
+            raise ValueError('Unrolling add_loop() would take %i lines, more than the maximum of %i' %
+                             (num_lines + num_body_lines*repeats, self.max_lines))
+        for n in range(repeats):
+            for key, line_repeats, wait_for_trigger in body.lines:
+                self._add_line(key, line_repeats, wait_for_trigger)
+        return self
+
+    def filenames(self):
+        """ Maps each waveform content key to the .wfm filename it is stored as """
+        return {key : '%s%03i.wfm' % (self.prefix, n) for n, key in enumerate(self.waveforms)}
+
+    def compile(self, max_lines = None):
+        """ Returns (wfm_filenames, wfm_repeats, wfm_trigger_wait) for the lines
+        of the .seq file, as taken by create_sequence().  Lines repeating more
+        than MAX_REPEATS times are split.  Raises a ValueError if there are
+        more than max_lines lines (default self.max_lines) """
+        if max_lines is None: max_lines = self.max_lines
+        filenames = self.filenames()
+        wfm_filenames, wfm_repeats, wfm_trigger_wait = [], [], []
+        for key, repeats, wait_for_trigger in self.lines:
+            while True:
+                line_repeats = repeats if repeats <= MAX_REPEATS else MAX_REPEATS
+                wfm_filenames.append(filenames[key])
+                wfm_repeats.append(line_repeats)
+                wfm_trigger_wait.append(int(wait_for_trigger))
+                repeats -= line_repeats
+                wait_for_trigger = False
+                if repeats <= 0:
+                    break
+        if len(wfm_filenames) > max_lines:
+            raise ValueError('Sequence has %i lines, more than the maximum of %i' %
+                             (len(wfm_filenames), max_lines))
+        return wfm_filenames, wfm_repeats, wfm_trigger_wait
+
+    def summary(self):
+        """ Returns the number of lines and waveform files, and the number of
+        samples played (with each forever-repeating line counted once) versus
+        the number of samples that have to be uploaded """
+        samples_played = sum(len(self.waveforms[key][0])*max(repeats, 1)
+                             for key, repeats, wait in self.lines)
+        samples_uploaded = sum(len(v) for v, m in self.waveforms.values())
+        return {'num_lines' : len(self.compile(max_lines = np.inf)[0]), 'num_waveforms' : len(self.waveforms),
+                'samples_played' : samples_played, 'samples_uploaded' : samples_uploaded}
+
+    def upload(self, awg, filename = 'temp.seq'):
+        """ Writes the waveform files (skipping any the AWG already holds, see
+        the AWG's waveform_cache) and then the .seq file to `awg`, a
+        TektronixAWG610 or the AWG7101 driver.  Returns summary() """
+        max_lines = getattr(awg, 'max_sequence_lines', self.max_lines)
+        self.compile(max_lines = max_lines) # Check the line count before uploading anything
+        filenames = self.filenames()
+        for key, (voltages, markers) in self.waveforms.items():
+            data_bytes = encode_wfm(voltages, markers, clock = self.clock)
+            data_key = waveform_key(data_bytes)
+            if not awg.waveform_cache.lookup(filenames[key], data_key):
+                awg.write_data_to_file(data = data_bytes, filename = filenames[key])
+                awg.waveform_cache.store(filenames[key], data_key, len(data_bytes))
+        wfm_filenames, wfm_repeats, wfm_trigger_wait = self.compile(max_lines = max_lines)
+        awg.create_sequence(filename = filename, wfm_filenames = wfm_filenames,
+                            wfm_repeats = wfm_repeats, wfm_trigger_wait = wfm_trigger_wait)
+        return self.summary()
@@ -0,0 +1,69 @@
+import numpy as np
+import time
+
+
+# One sample of the body of a Tektronix "MAGIC 1000" .wfm file: a little-endian
+# float32 voltage on [-1, 1] followed by a byte of marker bits (bit 0 is
+# marker 1, bit 1 is marker 2)
+WFM_DTYPE = np.dtype([('voltage', '<f4'), ('marker', 'u1')])
+
+
+def pad_sample_length(data, pad_value = None, min_length = 512, multiple = 8):
+    """ Pads `data` with pad_value (default the first sample) so it is at least
+    min_length samples long and a multiple of `multiple`.  Returns a numpy array """
+    data = np.asarray(data)
+    length = max(len(data), min_length)
+    length += (-length) % multiple
+    if length == len(data):
+        return data
+    if pad_value is None:
+        pad_value = data[0]
+    padded = np.empty(length, dtype = data.dtype)
+    padded[:len(data)] = data
+    padded[len(data):] = pad_value
+    return padded
+
+
+def validate_voltages(voltages):
+    """ Raises a ValueError unless voltages has >= 512 samples, a multiple of 8,
+    all on the [-1.0,+1.0] interval (NaNs are rejected too) """
+    if (len(voltages) < 512) or (len(voltages) % 8 != 0):
+        raise ValueError('Length of `voltages` array must be >=512 elements and divisible by 8')
+    if not np.all((voltages >= -1) & (voltages <= 1)):
+        raise ValueError('Values of `voltages` array must be on [-1.0,+1.0] interval')
+
+
+def encode_wfm(voltages, markers = None, clock = None):
+    """ Builds the contents of a .wfm file from arrays of voltages and marker
+    bytes in one vectorized step (no per-sample packing).  Returns bytes """
+    body = np.zeros(len(voltages), dtype = WFM_DTYPE)
+    body['voltage'] = voltages
+    if markers is not None:
+        body['marker'] = markers
+    len_body_bytes = body.nbytes
+    # Header, '#<num digits><num bytes>' block header, data, then the trailer
+    header = 'MAGIC 1000\r\n#%i%i' % (len(str(len_body_bytes)), len_body_bytes)
+    if clock is not None:
+        trailer = 'CLOCK %0.3e\r\n' % clock
+    else:
+        trailer = '\r\n'
+    return b''.join([header.encode(), body.view(np.uint8), trailer.encode()])
+
+
+def benchmark_encode_wfm(num_points_list = [1e3, 1e4, 1e5, 1e6, 1e7, 32e6], num_repeats = 3):
+    """ Times encode_wfm() (including validation) for each waveform length in
+    num_points_list.  Returns a dictionary mapping each length to seconds per
+    waveform and prints a summary """
+    results = {}
+    for num_points in num_points_list:
+        num_points = int(num_points)
+        voltages = np.sin(np.linspace(0, 2*np.pi, num_points))
+        markers = (np.arange(num_points) % 2).astype('uint8')
+        t_start = time.time()
+        for n in range(num_repeats):
+            validate_voltages(voltages)
+            encode_wfm(voltages, markers)
+        results[num_points] = (time.time() - t_start)/num_repeats
+        print('%i points: %0.4f s (%0.1f Mpts/s)' % (num_points, results[num_points],
+                                                        num_points/results[num_points]/1e6))
+    return results
@@ -1,21 +1,9 @@
-import pyvisa as visa
+from amcc.instruments.generic_instrument import GenericInstrument
 
-class ThorlabsPM100D(object):
+class ThorlabsPM100D(GenericInstrument):
     """Python class for Thorlabs PM100, written by Adam McCaughan."""
     def __init__(self, visa_name):
-        self.rm = visa.ResourceManager()
-        self.pyvisa = self.rm.open_resource(visa_name)
-        self.pyvisa.timeout = 5000 # Set response timeout (in milliseconds)
-        # self.pyvisa.query_delay = 1 # Set extra delay time between write and read commands
-
-    def read(self):
-        return self.pyvisa.read()
-    
-    def write(self, string):
-        self.pyvisa.write(string)
-
-    def query(self, string):
-        return self.pyvisa.query(string)
+        super().__init__(visa_name)
 
     def reset(self):
         self.write('*RST')
@@ -23,9 +11,6 @@ class ThorlabsPM100D(object):
     def identify(self):
         return self.query('*IDN?')
         
-    def close(self):
-        self.pyvisa.close()
-
 
     def read_power(self):
         #
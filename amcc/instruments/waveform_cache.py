@@ -0,0 +1,242 @@
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+
+
+# Where each VISA resource's cache is saved between Python sessions
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.amcc', 'waveform_cache')
+
+
+def waveform_key(data, *params):
+    """ Content hash of an encoded waveform (bytes or a numpy array) plus any
+    parameters that change what ends up on the instrument (clock, channel...) """
+    h = hashlib.sha1(memoryview(data).cast('B'))
+    h.update(repr(params).encode())
+    return h.hexdigest()
+
+
+class WaveformCache(object):
+    """ Keeps track of which waveforms are resident on an arbitrary waveform
+    generator, so that re-creating a waveform the instrument already holds
+    skips the upload.  Entries map a waveform name to the content hash
+    (see waveform_key) of what was last uploaded under that name, in least-
+    recently-used order.  Drivers use it like
+
+        key = waveform_key(data_bytes, clock)
+        if not self.waveform_cache.lookup(filename, key):
+            ... upload ...
+            self.waveform_cache.store(filename, key, len(data_bytes))
+
+    If max_bytes / max_entries are set, make_room() (before an upload) and
+    store() evict the least recently used waveforms, calling
+    delete_function(name) to free them on the instrument.  list_function()
+    should return the names currently on the instrument, or a dict mapping
+    them to their sizes in bytes; it is called by refresh() (and before the
+    first lookup) to forget waveforms that were deleted, resized or lost
+    behind the cache's back.  in_use_function() should return the names the
+    instrument is currently playing, which are never evicted.  Instruments
+    with case-insensitive names (which they report in upper case) should set
+    case_sensitive = False.
+
+    Entries are only kept in memory unless enable_persistence() is called """
+
+    def __init__(self, max_bytes = None, max_entries = None, list_function = None,
+                 delete_function = None, in_use_function = None, case_sensitive = True):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.list_function = list_function
+        self.delete_function = delete_function
+        self.in_use_function = in_use_function
+        self.case_sensitive = case_sensitive
+        self.name = None # VISA resource, set by get_waveform_cache()
+        self.path = None
+        self.identity = None
+        self.entries = OrderedDict() # Maps name -> (key, num_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._refreshed = False
+        self._lock = threading.RLock()
+
+    @property
+    def num_bytes(self):
+        return sum(num_bytes for key, num_bytes in self.entries.values())
+
+    def _name(self, name):
+        return name if self.case_sensitive else name.upper()
+
+    def enable_persistence(self, path = None, identity = None):
+        """ Saves the entries as JSON at `path` (default a file per VISA
+        resource in CACHE_DIR) whenever they change, and reloads what an
+        earlier Python session saved there, so waveforms still resident on the
+        instrument are not uploaded again.  Saved entries are only trusted if
+        `identity` (e.g. the *IDN? reply) matches the one they were saved with,
+        and the name and size still match the instrument's listing, so only
+        use this if nothing else writes to those waveform names """
+        with self._lock:
+            if self.list_function is None:
+                raise ValueError('Persistence needs a list_function to check saved entries against')
+            if path is None:
+                path = os.path.join(CACHE_DIR, re.sub(r'[^A-Za-z0-9_.-]+', '_', str(self.name)) + '.json')
+            self.path = path
+            self.identity = identity
+            self.load()
+
+    def load(self):
+        """ Reads the entries saved at self.path, if there are any """
+        with self._lock:
+            if (self.path is None) or (not os.path.exists(self.path)):
+                return
+            try:
+                with open(self.path) as f:
+                    saved = json.load(f)
+                if saved['identity'] != self.identity:
+                    return # A different instrument
+                entries = OrderedDict((name, tuple(entry)) for name, entry in saved['entries'])
+            except (OSError, ValueError, KeyError, TypeError):
+                return # Unreadable, start empty
+            entries.update(self.entries) # What this session knows is newer
+            self.entries = entries
+            self._refreshed = False
+
+    def save(self):
+        with self._lock:
+            if self.path is None:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok = True)
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump({'identity' : self.identity, 'entries' : list(self.entries.items())}, f)
+                os.replace(self.path + '.tmp', self.path)
+            except OSError:
+                pass # Only costs re-uploads in the next session
+
+    def refresh(self):
+        """ Drops any entries whose names are no longer on the instrument, or
+        whose size there no longer matches """
+        with self._lock:
+            self._refreshed = True
+            if self.list_function is None:
+                return
+            listing = self.list_function()
+            if isinstance(listing, dict):
+                sizes = {self._name(name) : size for name, size in listing.items()}
+            else:
+                sizes = {self._name(name) : None for name in listing}
+            for name, (key, num_bytes) in list(self.entries.items()):
+                if (name not in sizes) or (sizes[name] is not None and sizes[name] != num_bytes):
+                    del self.entries[name]
+            self.save()
+
+    def lookup(self, name, key):
+        """ True if `name` already holds the waveform with content hash `key` """
+        name = self._name(name)
+        with self._lock:
+            if not self._refreshed:
+                self.refresh()
+            entry = self.entries.get(name)
+            if (entry is not None) and (entry[0] == key):
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def make_room(self, name, num_bytes = 0):
+        """ Evicts least recently used waveforms until a new waveform of num_bytes
+        stored under `name` would fit, so the instrument has free memory before
+        the upload starts """
+        name = self._name(name)
+        with self._lock:
+            self.entries.pop(name, None) # Being replaced
+            in_use = None
+            while len(self.entries) > 0:
+                too_many = (self.max_entries is not None) and (len(self.entries) + 1 > self.max_entries)
+                too_big = (self.max_bytes is not None) and (self.num_bytes + num_bytes > self.max_bytes)
+                if not (too_many or too_big):
+                    break
+                if in_use is None: in_use = self._in_use()
+                if not self._evict_oldest(keep = in_use):
+                    break
+
+    def _in_use(self):
+        if self.in_use_function is None:
+            return set()
+        return set(self._name(name) for name in self.in_use_function())
+
+    def _evict_oldest(self, keep):
+        # Evicts the least recently used waveform not in `keep`, returns False
+        # if there is none
+        for old_name in self.entries:
+            if old_name not in keep:
+                self.evict(old_name)
+                return True
+        return False
+
+    def store(self, name, key, num_bytes = 0):
+        """ Records that `name` now holds `key`, evicting least recently used
+        waveforms if the cache is over its limits """
+        name = self._name(name)
+        with self._lock:
+            self.entries[name] = (key, num_bytes)
+            self.entries.move_to_end(name)
+            in_use = None
+            while len(self.entries) > 1 and self._over_limit():
+                if in_use is None: in_use = self._in_use() | {name}
+                if not self._evict_oldest(keep = in_use):
+                    break
+            self.save()
+
+    def _over_limit(self):
+        if (self.max_entries is not None) and (len(self.entries) > self.max_entries):
+            return True
+        if (self.max_bytes is not None) and (self.num_bytes > self.max_bytes):
+            return True
+        return False
+
+    def evict(self, name):
+        """ Forgets `name` and deletes it from the instrument """
+        name = self._name(name)
+        with self._lock:
+            self.entries.pop(name, None)
+            if self.delete_function is not None:
+                self.delete_function(name)
+            self.save()
+
+    def forget(self, name):
+        """ Forgets `name` without touching the instrument (e.g. after it has
+        been overwritten by something the cache did not see) """
+        name = self._name(name)
+        with self._lock:
+            if self.entries.pop(name, None) is not None:
+                self.save()
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._refreshed = False
+            self.save()
+
+
+# One cache per VISA resource, shared by every driver object using that
+# resource (see the session pool in generic_instrument)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_waveform_cache(instrument, **kwargs):
+    """ Returns the WaveformCache for the instrument's VISA resource.  `kwargs`
+    (see WaveformCache) are applied every time, so the list / delete functions
+    always belong to the most recently connected driver """
+    with _caches_lock:
+        key = instrument._visa_key
+        if key not in _caches:
+            _caches[key] = WaveformCache()
+            _caches[key].name = key
+        cache = _caches[key]
+        for name, value in kwargs.items():
+            setattr(cache, name, value)
+        cache._refreshed = False # Re-check what is resident when a driver (re)connects
+        return cache